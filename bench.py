@@ -0,0 +1,282 @@
+"""Offline benchmarks for main.py against the fake OpenAI backend in fake_openai.py.
+
+    python bench.py                               # everything, results in bench_results.json
+    python bench.py --sizes 100,1000 --skip e2e   # quick run
+
+Reports retrieval latency and recall vs taxonomy size for each index (recall on held-out,
+message-like queries, plus the two-stage indexes on the shipped taxonomy), prompt-build / token-count / JSON-parse cost,
+end-to-end async throughput at several concurrency levels and memory footprint. The JSON
+output carries the git commit so runs can be compared across commits.
+"""
+import argparse, asyncio, json, os, platform, resource, subprocess, sys, tempfile, time, tracemalloc
+
+import numpy as np
+
+import main
+from fake_openai import FakeAsyncOpenAI, FakeOpenAI, fake_labels
+
+SAMPLE_MESSAGES = [
+    "I was charged twice this month and don't know why.",
+    "I want to upgrade my data plan and increase my internet speed.",
+    "My calls keep dropping when I'm at home.",
+    "Please cancel my family plan and port out two numbers to prepaid.",
+    "Where is the nearest store? I need a new SIM card.",
+    "I lost my phone yesterday, can you block it?",
+    "Can I get a refund for the unused days on my billing cycle?",
+    "Wi-Fi calling stopped working after the update.",
+]
+
+
+def _timeit(fn, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1e3
+    return {"mean_ms": float(times.mean()), "p50_ms": float(np.percentile(times, 50)),
+            "p95_ms": float(np.percentile(times, 95)), "repeat": repeat}
+
+
+def _classifier(workdir: str, taxonomy=None, **kwargs) -> main.Classifier:
+    # everything (store, caches) lives in workdir so runs never touch the real caches
+    os.makedirs(workdir, exist_ok=True)
+    return main.Classifier(
+        taxonomy=taxonomy,
+        embed_model="fake-embedding",
+        store_dir=os.path.join(workdir, "store"),
+        client=kwargs.pop("client", FakeOpenAI()),
+        aclient=kwargs.pop("aclient", FakeAsyncOpenAI()),
+        embedding_cache=main.EmbeddingCache(os.path.join(workdir, "embeddings.sqlite")),
+        result_cache=main.ResultCache(os.path.join(workdir, "results.sqlite")),
+        **kwargs,
+    )
+
+
+def _synthetic_taxonomy(domains: np.ndarray) -> list[dict]:
+    # one entry per row of the synthetic matrix, in the domain hierarchical mode groups by
+    base = main.inquiry_types
+    return [{"type": f"{base[i % len(base)]['type']} #{i}", "definition": base[i % len(base)]["definition"],
+             "domain": f"domain {d}"} for i, d in enumerate(domains)]
+
+
+def _clustered_vectors(rng, n: int, dim: int, inter: float = 0.30,
+                       intra: float = 0.39) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # real taxonomies group into product lines; uniform random vectors would make every ANN index look bad,
+    # but tight clusters make them look too good. Rows get a shared direction, a cluster direction and
+    # noise, weighted so that mean cosine across / within clusters is `inter` / `intra` (0.30 / 0.39
+    # for the shipped taxonomy's text-embedding-3-small vectors across / within domains).
+    # Returns (unit rows, cluster of each row, cluster centers).
+    basis = main._unit_rows(rng.standard_normal((max(1, n // 50) + 1, dim), dtype=np.float32))
+    shared, directions = basis[0], basis[1:]
+    centers = main._unit_rows(np.sqrt(inter) * shared + np.sqrt(intra - inter) * directions)
+    clusters = rng.integers(0, len(centers), n)
+    noise = rng.standard_normal((n, dim), dtype=np.float32) * np.sqrt((1 - intra) / dim)
+    return main._unit_rows(np.sqrt(intra) * centers[clusters] + noise), clusters, centers
+
+
+def _synthetic_domains(rng, clusters: np.ndarray, purity: float = 0.5) -> np.ndarray:
+    # editors file labels by product line, not by embedding geometry: a row keeps its generating
+    # cluster as domain with probability `purity`, else lands in a uniformly random one. Reusing the
+    # clusters outright hands hierarchical mode the exact partition the queries were built from.
+    n_domains = clusters.max() + 1
+    return np.where(rng.random(len(clusters)) < purity, clusters, rng.integers(0, n_domains, len(clusters)))
+
+
+def _message_like_queries(rng, sources: np.ndarray, n: int, noise: float = 1.0) -> np.ndarray:
+    # a message mixes one or two intents with plenty of unrelated wording: sum one or two source
+    # vectors and add isotropic noise of about the same norm (cosine ~0.5 to its intents, as real
+    # message/definition pairs score), rather than a database row plus a little jitter
+    dim = sources.shape[1]
+    picks = rng.integers(0, len(sources), (n, 2))
+    mixed = sources[picks[:, 0]] + sources[picks[:, 1]] * (rng.random((n, 1)) < 0.5)
+    return main._unit_rows(main._unit_rows(mixed)
+                           + rng.standard_normal((n, dim), dtype=np.float32) * (noise / np.sqrt(dim)))
+
+
+INDEX_VARIANTS = {"exact": ("exact", False), "ivf": ("ivf", False), "ivf-int8": ("ivf", True),
+                  "hierarchical": ("hierarchical", False)}
+
+
+def bench_retrieval(workdir: str, sizes: list[int], repeat: int, indexes: list[str], dim: int = 1536) -> list:
+    rng = np.random.default_rng(0)
+    results = []
+    for n in sizes:
+        tax_dir = os.path.join(workdir, f"tax{n}")
+        matrix, clusters, centers = _clustered_vectors(rng, n, dim)
+        taxonomy = _synthetic_taxonomy(_synthetic_domains(rng, clusters))
+        # held out: built from fresh points of the same clusters, never from rows in the index
+        queries = _message_like_queries(rng, centers, 64)
+        store = _classifier(tax_dir, taxonomy=taxonomy)
+        store.save_definition_embeddings([store._definition_key(item) for item in taxonomy], matrix)
+
+        for name in indexes:
+            kind, quantize = INDEX_VARIANTS[name]
+            clf = _classifier(tax_dir, taxonomy=taxonomy, index=kind, quantize=quantize)
+            start = time.perf_counter()
+            clf.warm_up()
+            build = time.perf_counter() - start
+
+            def one():
+                clf._retrieve_vectors(queries[:1])
+
+            def batch():
+                clf._retrieve_vectors(queries)
+
+            results.append({
+                "labels": n, "index": name, "build_seconds": build,
+                "single_query": _timeit(one, repeat), "batch_64": _timeit(batch, max(3, repeat // 10)),
+                f"recall@{main.TOP_K}": clf.index_recall(queries)[f"recall@{main.TOP_K}"],
+                **clf.footprint(),
+            })
+            print(f"retrieval n={n:>7} {name:>12}: {results[-1]['single_query']['mean_ms']:.3f} ms/query, "
+                  f"recall {results[-1][f'recall@{main.TOP_K}']:.3f}", file=sys.stderr)
+    return results
+
+
+def bench_retrieval_real_taxonomy(workdir: str, indexes: list[str], n_queries: int = 200,
+                                  nprobes: tuple = (1, 2, 3, 5)) -> list:
+    """Recall of the two-stage indexes on the shipped taxonomy (10 domains of ~10 labels) at several nprobe.
+
+    Uses the real text-embedding-3-small definition vectors from the legacy JSON when they
+    match the current definitions, else the fake backend's embeddings.
+    """
+    rng = np.random.default_rng(1)
+    real_dir = os.path.join(workdir, "real")
+    taxonomy = main.inquiry_types
+    store = _classifier(real_dir, taxonomy=taxonomy)
+    legacy_keys, legacy = main.Classifier(taxonomy=taxonomy, embed_model=main.EMBED_CACHE_MODEL)._read_legacy_json()
+    if len(legacy_keys) == len(taxonomy):
+        vectors = f"{main.EMBED_CACHE_MODEL} (legacy JSON)"
+        matrix = main._unit_rows(legacy)
+        store.save_definition_embeddings([store._definition_key(item) for item in taxonomy], matrix)
+    else:
+        vectors = "fake"
+        matrix = store.definition_matrix
+    queries = _message_like_queries(rng, matrix, n_queries)
+
+    results = []
+    for name in indexes:
+        kind, quantize = INDEX_VARIANTS[name]
+        if kind == "exact":
+            continue
+        for nprobe in nprobes:
+            clf = _classifier(real_dir, taxonomy=taxonomy, index=kind, quantize=quantize, nprobe=nprobe)
+            recall = clf.index_recall(queries)[f"recall@{main.TOP_K}"]
+            results.append({"labels": len(taxonomy), "index": name, "nprobe": nprobe, "vectors": vectors,
+                            f"recall@{main.TOP_K}": recall})
+            print(f"real taxonomy {name:>12} nprobe={nprobe}: recall {recall:.3f}", file=sys.stderr)
+    return results
+
+
+def bench_prompt_and_parse(repeat: int) -> dict:
+    cands = [{"type": item["type"], "definition": item["definition"], "score": 0.5, "normalized": 0.9}
+             for item in main.inquiry_types[:main.TOP_K]]
+    msg = SAMPLE_MESSAGES[0]
+    verbose = main.build_prompt(msg, cands)
+    compact = main.build_prompt(msg, cands, compact=True)
+    reply = fake_labels(verbose)
+    wrapped = f"Sure! Here you go:\n{reply}\nThanks."
+    return {
+        "build_prompt": _timeit(lambda: main.build_prompt(msg, cands), repeat),
+        "build_prompt_compact": _timeit(lambda: main.build_prompt(msg, cands, compact=True), repeat),
+        "count_tokens": _timeit(lambda: main.count_tokens(verbose), repeat),
+        "prompt_tokens": main.count_tokens(verbose),
+        "prompt_tokens_compact": main.count_tokens(compact),
+        "tiktoken": main.tiktoken is not None,
+        "parse_json": _timeit(lambda: main._parse_labels(reply, cands), repeat),
+        "parse_json_fallback": _timeit(lambda: main._parse_labels(wrapped, cands), repeat),
+    }
+
+
+def bench_end_to_end(workdir: str, levels: list[int], n_messages: int, latency: float,
+                     error_rate: float) -> list:
+    results = []
+    for level in levels:
+        run_dir = os.path.join(workdir, f"e2e{level}")
+        aclient = FakeAsyncOpenAI(latency=latency, jitter=latency / 2, error_rate=error_rate)
+        clf = _classifier(run_dir, aclient=aclient)
+        clf.warm_up()
+        # unique messages so the result cache never short-circuits the LLM call
+        messages = [f"{SAMPLE_MESSAGES[i % len(SAMPLE_MESSAGES)]} (ticket {i})" for i in range(n_messages)]
+        start = time.perf_counter()
+        out = asyncio.run(clf.classify_batch_async(messages, concurrency=level, return_exceptions=True))
+        elapsed = time.perf_counter() - start
+        results.append({
+            "concurrency": level, "messages": n_messages, "seconds": elapsed,
+            "messages_per_second": n_messages / elapsed,
+            "failed": sum(isinstance(r, BaseException) for r in out),
+            "fake_calls": dict(aclient.calls),
+        })
+        print(f"e2e concurrency={level:>3}: {n_messages / elapsed:.1f} msg/s", file=sys.stderr)
+    return results
+
+
+def bench_memory(workdir: str) -> dict:
+    mem_dir = os.path.join(workdir, "memory")
+    start = time.perf_counter()
+    _classifier(mem_dir).warm_up()  # empty store: embeds every definition through the fake
+    bootstrap = time.perf_counter() - start
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    clf = _classifier(mem_dir).warm_up()  # what a new worker pays with the store already on disk
+    load = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"bootstrap_seconds": bootstrap, "cold_start_seconds": load, "tracemalloc_peak_bytes": peak,
+            **clf.footprint(), "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", default="bench_results.json")
+    parser.add_argument("--sizes", default="100,1000,10000,100000", help="taxonomy sizes for retrieval")
+    parser.add_argument("--indexes", default="exact,ivf,ivf-int8,hierarchical", help=f"of: {','.join(INDEX_VARIANTS)}")
+    parser.add_argument("--concurrency", default="1,4,16,64")
+    parser.add_argument("--messages", type=int, default=256, help="messages per end-to-end run")
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated seconds per API call")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--skip", default="", help="comma list of: retrieval,prompt,e2e,memory")
+    args = parser.parse_args(argv)
+    skip = set(filter(None, args.skip.split(",")))
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        # memory first, before other benchmarks inflate the process
+        if "memory" not in skip:
+            report["memory"] = bench_memory(workdir)
+        if "retrieval" not in skip:
+            report["retrieval"] = bench_retrieval(workdir, [int(n) for n in args.sizes.split(",")], args.repeat,
+                                                  args.indexes.split(","))
+            report["retrieval_real_taxonomy"] = bench_retrieval_real_taxonomy(workdir, args.indexes.split(","))
+        if "prompt" not in skip:
+            report["prompt"] = bench_prompt_and_parse(args.repeat)
+        if "e2e" not in skip:
+            report["end_to_end"] = bench_end_to_end(
+                workdir, [int(c) for c in args.concurrency.split(",")], args.messages, args.latency, args.error_rate
+            )
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.output}", file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,137 @@
+"""Offline stand-ins for the OpenAI client, for exercising main.py without network access.
+
+    from fake_openai import FakeOpenAI, FakeAsyncOpenAI
+    clf = main.Classifier(client=FakeOpenAI(), aclient=FakeAsyncOpenAI(latency=0.2, error_rate=0.05))
+    clf.classify_batch(msgs)
+
+Embeddings are deterministic bag-of-words vectors (texts sharing words point in similar
+directions), and chat completions mark a candidate label true when the message mentions
+one of the label's words. Latency, failure rate, the share of replies wrapped in prose
+(forcing main._extract_json) and an input length limit (a non-retryable 400, like an
+over-long embedding input) are configurable.
+"""
+import asyncio, hashlib, json, random, re, time
+from types import SimpleNamespace
+
+import numpy as np
+
+DIM = 1536
+
+
+class FakeAPIError(Exception):
+    """Raised for simulated failures; carries a status_code like openai.APIStatusError."""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"simulated API error {status_code}")
+        self.status_code = status_code
+
+
+def _words(text: str) -> list[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def fake_embedding(text: str, dim: int = DIM) -> list[float]:
+    vec = np.zeros(dim, dtype=np.float32)
+    for word in _words(text) or [""]:
+        seed = int.from_bytes(hashlib.sha256(word.encode("utf-8")).digest()[:8], "little")
+        vec += np.random.default_rng(seed).standard_normal(dim, dtype=np.float32)
+    return (vec / (np.linalg.norm(vec) + 1e-8)).tolist()
+
+
+def fake_labels(prompt: str) -> str:
+    # the message is the last "Message:" line; candidate labels are the keys of the last {...} block
+    first_line = prompt[prompt.rfind("Message:"):].partition("\n")[0]
+    message_words = {w for w in _words(first_line) if len(w) > 3}
+    labels = {}
+    label_block = prompt[prompt.rfind("{"):]
+    for rank, label in enumerate(re.findall(r'^\s*"([^"]+)"\s*:', label_block, re.M), start=1):
+        hits = [w for w in _words(label) if w in message_words]
+        labels[label] = {"reason": f"mentions '{hits[0]}'", "confidence": 0.9,
+                         "retrieved_rank": rank} if hits else False
+    return json.dumps(labels)
+
+
+def _usage(prompt_tokens: int, completion_tokens: int = 0):
+    return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                           total_tokens=prompt_tokens + completion_tokens)
+
+
+class _Backend:
+    def __init__(self, dim: int = DIM, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 429, prose_rate: float = 0.0,
+                 max_input_chars: int = None, seed: int = 0):
+        self.dim = dim
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.prose_rate = prose_rate
+        self.max_input_chars = max_input_chars
+        self.calls = {"embeddings": 0, "chat": 0, "errors": 0}
+        self._rng = random.Random(seed)
+
+    def _delay(self) -> float:
+        return max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+
+    def _maybe_fail(self):
+        if self.error_rate and self._rng.random() < self.error_rate:
+            self.calls["errors"] += 1
+            raise FakeAPIError(self.error_status)
+
+    def embed(self, model: str, input):
+        self.calls["embeddings"] += 1
+        self._maybe_fail()
+        texts = [input] if isinstance(input, str) else list(input)
+        if self.max_input_chars and any(len(t) > self.max_input_chars for t in texts):
+            self.calls["errors"] += 1
+            raise FakeAPIError(400)
+        data = [SimpleNamespace(index=i, embedding=fake_embedding(t, self.dim)) for i, t in enumerate(texts)]
+        return SimpleNamespace(data=data, model=model, usage=_usage(sum(len(t) // 4 for t in texts)))
+
+    def chat(self, model: str, messages: list[dict], max_tokens: int = 256, **_):
+        self.calls["chat"] += 1
+        self._maybe_fail()
+        prompt = messages[-1]["content"]
+        content = fake_labels(prompt)
+        if self.prose_rate and self._rng.random() < self.prose_rate:
+            content = f"Here is the classification:\n{content}\nLet me know if you need anything else."
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(index=0, finish_reason="stop",
+                                     message=SimpleNamespace(role="assistant", content=content))],
+            usage=_usage(len(prompt) // 4, min(max_tokens, len(content) // 4)),
+        )
+
+
+class FakeOpenAI(_Backend):
+    """Synchronous fake with client.embeddings.create / client.chat.completions.create."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.embeddings = SimpleNamespace(create=self._embeddings_create)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat_create))
+
+    def _embeddings_create(self, model: str, input, **_):
+        time.sleep(self._delay())
+        return self.embed(model, input)
+
+    def _chat_create(self, **kwargs):
+        time.sleep(self._delay())
+        return _Backend.chat(self, **kwargs)
+
+
+class FakeAsyncOpenAI(_Backend):
+    """Async fake mirroring openai.AsyncOpenAI."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.embeddings = SimpleNamespace(create=self._embeddings_create)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat_create))
+
+    async def _embeddings_create(self, model: str, input, **_):
+        await asyncio.sleep(self._delay())
+        return self.embed(model, input)
+
+    async def _chat_create(self, **kwargs):
+        await asyncio.sleep(self._delay())
+        return _Backend.chat(self, **kwargs)
@@ -1,19 +1,74 @@
-from openai import OpenAI
-import os, json, hashlib, math, re, time
+from openai import OpenAI, AsyncOpenAI
+import openai
+import argparse, asyncio, csv, os, json, hashlib, logging, random, re, sqlite3, sys, threading, time
+from contextlib import contextmanager
 from functools import lru_cache
+from collections import deque
+from itertools import islice
+import numpy as np
 from dotenv import load_dotenv
 
+try:
+    import tiktoken
+except ImportError:  # optional: exact token counts; otherwise ~4 chars/token
+    tiktoken = None
+
 load_dotenv()
 
-# === OpenAI Setup ===
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# per-call tracing (top-K table, prompt, raw output) is logged at DEBUG; silent unless configured
+log = logging.getLogger("classifier")
 
 # === Config ===
 EMBED_MODEL = "text-embedding-3-small"
 LLM_MODEL = "gpt-4o-mini"
 TOP_K = 10
-EMBED_CACHE_PATH = "definition_embeddings.json"
+EMBED_CACHE_PATH = "definition_embeddings.json"  # legacy JSON store (type, definition, embedding), imported once if present
+EMBED_CACHE_MODEL = "text-embedding-3-small"      # model the legacy JSON was built with
+EMBED_STORE_DIR = "definition_store"
+EMBED_STORE_DTYPE = "float16"  # "float32" lets workers memory-map the matrix as-is instead of copying it
+EMBED_BATCH_MAX_ITEMS = 2048      # API limit on inputs per embeddings request
+EMBED_BATCH_MAX_CHARS = 200_000   # rough stand-in for the per-request token limit (~4 chars/token)
+ASYNC_CONCURRENCY = 16     # max in-flight LLM calls in the async pipeline
+LLM_RPM = None             # requests per minute; None = unlimited
+LLM_TPM = None             # (estimated) tokens per minute; None = unlimited
+LLM_MAX_RETRIES = 5
+LLM_BACKOFF_BASE = 0.5     # seconds, doubled per attempt
+LLM_BACKOFF_MAX = 30.0
+MESSAGE_TIMEOUT = 120.0    # seconds per LLM call attempt, counted once it has a concurrency slot
+BATCH_CHUNK_SIZE = 256     # rows held in memory (and checkpointed) at a time by the batch CLI
+BATCH_CHUNKS_AHEAD = 2     # chunks classified ahead of the one being written, so a slow row doesn't idle the slots
+QUERY_CACHE_PATH = "embedding_cache.sqlite"
+QUERY_CACHE_MAX_ENTRIES = 50_000
+QUERY_CACHE_MAX_BYTES = 256 * 1024 * 1024
+QUERY_CACHE_TTL = 30 * 24 * 3600  # seconds; None keeps entries until evicted by size
+RESULT_CACHE_PATH = "result_cache.sqlite"
+RESULT_CACHE_MAX_ENTRIES = 200_000
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+RESULT_CACHE_TTL = 7 * 24 * 3600
+CACHE_BUSY_TIMEOUT = 30  # seconds a cache write waits for another process's lock
 MIN_CONFIDENCE = 0.6
+COMPACT_PROMPT = False          # short instructions + one-line few-shot instead of the verbose template
+ADAPTIVE_K = False              # cut candidates by score gap / normalized score instead of a fixed TOP_K
+ADAPTIVE_MIN_K = 3
+ADAPTIVE_SCORE_GAP = 0.05       # stop after a candidate whose score is this far above the next one
+ADAPTIVE_MIN_NORMALIZED = 0.6   # drop candidates whose min-max normalized score is below this
+OUTPUT_TOKENS_BASE = 16
+OUTPUT_TOKENS_PER_LABEL = 48    # enough for a full explanation object per candidate
+SEGMENT_MAX_CHARS = 600         # transcript windows: consecutive turns packed up to this size
+SEGMENT_POOLING = "max"         # "max" or "attention" pooling of per-segment label scores
+SEGMENT_TEMPERATURE = 0.05      # softmax temperature for attention pooling
+SEGMENT_TOP_N = 4               # most relevant segments sent to the LLM
+RETRIEVAL_INDEX = "exact"       # "exact", "hierarchical" (taxonomy domains) or "ivf" (k-means clusters)
+INDEX_NPROBE = 3                # clusters/domains searched per query by the two-stage indexes
+# recall@10 at nprobe 3 on the shipped taxonomy (bench.py, real embeddings): ivf 0.81, hierarchical 0.76;
+# nprobe 5 gets ivf 0.94 / hierarchical 0.89. Raise it or use "exact" when recall matters more than latency.
+INDEX_LISTS = None              # IVF cluster count; None = sqrt(n_labels)
+INDEX_QUANTIZE = False          # index keeps int8 codes + per-row scale as the only copy of the vectors
+LOCAL_HEAD_PATH = "local_head.npz"
+LOCAL_HEAD_HIGH = 0.9           # local head answers only if every candidate is >= HIGH or <= LOW
+LOCAL_HEAD_LOW = 0.1
+LOCAL_HEAD_MIN_POSITIVES = 5    # labels with fewer training positives always go to the LLM
+LOCAL_HEAD_SHADOW_RATE = 0.02   # share of locally answered messages also sent to the LLM to measure agreement
 
 # === Inquiry Type ===
 inquiry_types = [
@@ -138,6 +193,14 @@ inquiry_types = [
     {"type": "Service Cancellation",        "definition": "Customer wants to terminate service and possibly port out their number."}
 ]
 
+# coarse groups used by hierarchical retrieval, in the same blocks of ten as the list above
+INQUIRY_DOMAINS = [
+    "Billing & Account", "Plans & Promotions", "Technical Service", "Device & Hardware", "SIM & Number",
+    "Messaging & Content", "Orders & Logistics", "Account Management", "Specialized / B2B", "Feedback & Misc",
+]
+for _i, _item in enumerate(inquiry_types):
+    _item.setdefault("domain", INQUIRY_DOMAINS[_i // 10])
+
 # === Helper Functions ===
 def _extract_json(text: str) -> str:
     match = re.search(r'\{.*\}', text, re.S)
@@ -145,54 +208,462 @@ def _extract_json(text: str) -> str:
         raise ValueError("No JSON object found in model output.")
     return match.group(0)
 
-@lru_cache(maxsize=None)
-def get_embedding(text: str) -> list[float]:
-    resp = client.embeddings.create(model=EMBED_MODEL, input=[text])
-    return resp.data[0].embedding
-
-def cosine(a: list[float], b: list[float]) -> float:
-    dot = sum(x * y for x, y in zip(a, b))
-    mag_a = math.sqrt(sum(x * x for x in a))
-    mag_b = math.sqrt(sum(y * y for y in b))
-    return dot / (mag_a * mag_b + 1e-8)
-
-# === Save/load embeddings ===
-def save_definition_embeddings():
-    data = []
-    for item in inquiry_types:
-        emb = get_embedding(item["definition"])
-        data.append({"type": item["type"], "embedding": emb})
-    with open(EMBED_CACHE_PATH, "w") as f:
-        json.dump(data, f)
-
-def load_definition_embeddings():
-    if not os.path.exists(EMBED_CACHE_PATH):
-        print("Saving definition embeddings...")
-        save_definition_embeddings()
-    with open(EMBED_CACHE_PATH) as f:
-        data = json.load(f)
-    return [item["embedding"] for item in data]
-
-# === Load definition embeddings once
-definition_embeddings = load_definition_embeddings()
+def _normalize_text(text: str) -> str:
+    return " ".join(text.split())
 
-def retrieve_definitions(message: str, k: int = TOP_K):
-    q_vec = get_embedding(message)
-    scored = [
-        {"type": item["type"], "definition": item["definition"], "score": cosine(q_vec, d_emb)}
-        for item, d_emb in zip(inquiry_types, definition_embeddings)
-    ]
-    max_score = max(s["score"] for s in scored)
-    min_score = min(s["score"] for s in scored)
-    for s in scored:
-        s["normalized"] = (s["score"] - min_score) / (max_score - min_score + 1e-8)
-    top = sorted(scored, key=lambda x: x["score"], reverse=True)[:k]
-
-    print("Top-K retrieved labels:")
-    for i, item in enumerate(top, start=1):
-        print(f"{i:2d}. {item['type']:30}  score: {item['score']:.3f}")
-
-    return top
+def _pack_batches(texts: list[str], max_items: int | None = None, max_chars: int | None = None) -> list[list[str]]:
+    max_items = max_items or EMBED_BATCH_MAX_ITEMS
+    max_chars = max_chars or EMBED_BATCH_MAX_CHARS
+    batches, batch, size = [], [], 0
+    for text in texts:
+        if batch and (len(batch) >= max_items or size + len(text) > max_chars):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(text)
+        size += len(text)
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _unit_rows(vectors) -> np.ndarray:
+    # float32 (n, dim) matrix with every row scaled to unit length, so cosine == dot product
+    mat = np.asarray(vectors, dtype=np.float32)
+    if mat.ndim == 1:
+        mat = mat[None, :]
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    return mat / (norms + 1e-8)
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    # partial selection per row, then sort only the k survivors (best first)
+    k = max(0, min(k, scores.shape[1]))
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.intp)
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(idx, order, axis=1)
+
+def split_transcript(text: str, max_chars: int = None) -> list[str]:
+    """Split a transcript into windows of consecutive turns (non-empty lines) of at most max_chars."""
+    max_chars = max_chars or SEGMENT_MAX_CHARS
+    turns = []
+    for line in text.splitlines():
+        line = _normalize_text(line)
+        # a single over-long turn is cut into max_chars pieces
+        turns.extend(line[i:i + max_chars] for i in range(0, len(line), max_chars))
+
+    segments, window = [], ""
+    for turn in turns:
+        if window and len(window) + 1 + len(turn) > max_chars:
+            segments.append(window)
+            window = ""
+        window = f"{window}\n{turn}" if window else turn
+    if window:
+        segments.append(window)
+    return segments
+
+def pool_segment_scores(scores: np.ndarray, pooling: str = None, temperature: float = None) -> np.ndarray:
+    """Pool (n_segments, n_labels) scores into one row per label, by max or softmax attention over segments."""
+    pooling = pooling or SEGMENT_POOLING
+    if pooling == "max":
+        return scores.max(axis=0)
+    if pooling == "attention":
+        weights = np.exp((scores - scores.max(axis=0)) / (temperature or SEGMENT_TEMPERATURE))
+        return (weights * scores).sum(axis=0) / weights.sum(axis=0)
+    raise ValueError(f"Unknown pooling: {pooling!r}")
+
+def _adaptive_cut(cands: list[dict], min_k: int = None, gap: float = None,
+                  min_normalized: float = None) -> list[dict]:
+    # cands are sorted best first; keep at least min_k, then stop at the first big score gap
+    # or the first candidate below the normalized-score threshold
+    min_k = ADAPTIVE_MIN_K if min_k is None else min_k
+    gap = ADAPTIVE_SCORE_GAP if gap is None else gap
+    min_normalized = ADAPTIVE_MIN_NORMALIZED if min_normalized is None else min_normalized
+    keep = min(min_k, len(cands))
+    while keep < len(cands):
+        if cands[keep]["normalized"] < min_normalized or cands[keep - 1]["score"] - cands[keep]["score"] > gap:
+            break
+        keep += 1
+    return cands[:keep]
+
+def _log_candidates(cands: list[dict]):
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Top-K retrieved labels:\n%s", "\n".join(
+            f"{i:2d}. {item['type']:30}  score: {item['score']:.3f}" for i, item in enumerate(cands, start=1)
+        ))
+
+# === Retrieval indexes ===
+# search(queries, k) -> (top indices, top scores, min score, max score) per query; queries are unit rows.
+# min/max are over every label the index actually scored, which for the two-stage indexes is
+# only the probed clusters. score(queries, ids) -> cosine scores against just those rows (all when None).
+class ExactIndex:
+    """Brute-force cosine search over the whole definition matrix."""
+
+    def __init__(self, matrix: np.ndarray):
+        self.matrix = matrix
+
+    def score(self, queries: np.ndarray, ids: np.ndarray = None) -> np.ndarray:
+        return queries @ (self.matrix if ids is None else self.matrix[ids]).T
+
+    def search(self, queries: np.ndarray, k: int):
+        scores = queries @ self.matrix.T
+        top = _top_k_indices(scores, k)
+        return top, np.take_along_axis(scores, top, axis=1), scores.min(axis=1), scores.max(axis=1)
+
+class IVFIndex:
+    """Two-stage search: rank cluster centroids, then score only the labels in the best `nprobe` clusters.
+
+    Clusters come from taxonomy groups (from_groups) or spherical k-means (kmeans). With
+    quantize=True the index keeps only int8 codes plus a per-row scale (4x smaller than float32)
+    and no reference to the matrix it was built from, so the caller can drop that matrix.
+    """
+
+    def __init__(self, matrix: np.ndarray, assignments: np.ndarray, nprobe: int = INDEX_NPROBE,
+                 quantize: bool = INDEX_QUANTIZE):
+        assignments = np.asarray(assignments)
+        self.lists = [ids for ids in (np.flatnonzero(assignments == c) for c in np.unique(assignments)) if len(ids)]
+        self.centroids = _unit_rows(np.stack([matrix[ids].mean(axis=0) for ids in self.lists]))
+        self.nprobe = nprobe
+        self.quantize = quantize
+        self.size = len(matrix)
+        if quantize:
+            self.scale = (np.abs(matrix).max(axis=1) / 127 + 1e-12).astype(np.float32)
+            self.codes = np.round(matrix / self.scale[:, None]).astype(np.int8)
+        else:
+            self.vectors = matrix
+
+    @classmethod
+    def from_groups(cls, matrix: np.ndarray, groups: list[str], **kwargs):
+        names = {name: i for i, name in enumerate(dict.fromkeys(groups))}
+        return cls(matrix, np.array([names[g] for g in groups]), **kwargs)
+
+    @classmethod
+    def kmeans(cls, matrix: np.ndarray, n_lists: int = None, iters: int = 10, sample: int = 20_000,
+               seed: int = 0, **kwargs):
+        """Spherical k-means on (a sample of) the rows, then assign every row to its nearest centroid."""
+        rng = np.random.default_rng(seed)
+        n = len(matrix)
+        n_lists = min(n, n_lists or INDEX_LISTS or max(1, int(np.sqrt(n))))
+        train = matrix[rng.choice(n, min(n, sample), replace=False)] if n > sample else matrix
+        centroids = train[rng.choice(len(train), n_lists, replace=False)]
+        for _ in range(iters):
+            nearest = np.argmax(train @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = train[nearest == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            centroids = _unit_rows(centroids)
+        assignments = np.concatenate([
+            np.argmax(matrix[i:i + 8192] @ centroids.T, axis=1) for i in range(0, n, 8192)
+        ])
+        return cls(matrix, assignments, **kwargs)
+
+    @property
+    def nbytes(self) -> int:
+        stored = self.codes.nbytes + self.scale.nbytes if self.quantize else self.vectors.nbytes
+        return stored + self.centroids.nbytes
+
+    def reconstruct(self) -> np.ndarray:
+        """Every row as float32 in matrix order (dequantized when quantize=True)."""
+        return self.codes.astype(np.float32) * self.scale[:, None] if self.quantize else self.vectors
+
+    def score(self, queries: np.ndarray, ids: np.ndarray = None) -> np.ndarray:
+        ids = np.arange(self.size) if ids is None else np.asarray(ids)
+        if not self.quantize:
+            return queries @ self.vectors[ids].T
+        # from the codes, a block of rows at a time, so the float32 copy never exists in full
+        return np.concatenate([
+            (queries @ self.codes[block].T.astype(np.float32)) * self.scale[block]
+            for block in np.array_split(ids, max(1, len(ids) // 8192))
+        ], axis=1)
+
+    def _scores(self, ids: np.ndarray, q: np.ndarray) -> np.ndarray:
+        if self.quantize:
+            # scale after the dot product: one multiply per row instead of one per element
+            return (self.codes[ids] @ q) * self.scale[ids]
+        return self.vectors[ids] @ q
+
+    def search(self, queries: np.ndarray, k: int):
+        k = min(k, sum(len(ids) for ids in self.lists))
+        order = np.argsort(-(queries @ self.centroids.T), axis=1)
+        top = np.zeros((len(queries), k), dtype=np.intp)
+        top_scores = np.zeros((len(queries), k), dtype=np.float32)
+        mins = np.zeros(len(queries), dtype=np.float32)
+        maxs = np.zeros(len(queries), dtype=np.float32)
+        for row, q in enumerate(queries):
+            # probe the nprobe best clusters, and more if they hold fewer than k labels
+            probed, count = [], 0
+            for c in order[row]:
+                if len(probed) >= self.nprobe and count >= k:
+                    break
+                probed.append(self.lists[c])
+                count += len(self.lists[c])
+            ids = np.concatenate(probed)
+            scores = self._scores(ids, q)
+            best = _top_k_indices(scores[None, :], k)[0]
+            top[row], top_scores[row] = ids[best], scores[best]
+            mins[row], maxs[row] = scores.min(), scores.max()
+        return top, top_scores, mins, maxs
+
+def build_index(kind: str, matrix: np.ndarray, taxonomy: list[dict], **kwargs):
+    if kind == "exact":
+        return ExactIndex(matrix)
+    if kind == "hierarchical":
+        if all("domain" in item for item in taxonomy):
+            return IVFIndex.from_groups(matrix, [item["domain"] for item in taxonomy], **kwargs)
+        return IVFIndex.kmeans(matrix, **kwargs)  # no domains to group by
+    if kind == "ivf":
+        return IVFIndex.kmeans(matrix, **kwargs)
+    raise ValueError(f"Unknown retrieval index: {kind!r}")
+
+def measure_recall(index, exact: ExactIndex, queries: np.ndarray, k: int) -> float:
+    """Mean fraction of the exact top-k that the index also returns."""
+    approx_top = index.search(queries, k)[0]
+    exact_top = exact.search(queries, k)[0]
+    return float(np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx_top, exact_top)]))
+
+# === Instrumentation ===
+class Metrics:
+    """In-process counters and per-stage timers with pluggable hooks and a Prometheus text export.
+
+    Every inc()/observe() is forwarded to the registered hooks as hook(name, value, labels),
+    e.g. to push into statsd or an APM; to_prometheus() renders the accumulated totals.
+    """
+
+    def __init__(self):
+        self.counters = {}   # (name, labels) -> total
+        self.timings = {}    # (name, labels) -> [count, sum, max]
+        self.hooks = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self._notify(name, value, labels)
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            stat = self.timings.setdefault(key, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2] = max(stat[2], seconds)
+        self._notify(name, seconds, labels)
+
+    def _notify(self, name: str, value: float, labels: dict):
+        # a broken exporter must not fail the classification that is being measured
+        for hook in self.hooks:
+            try:
+                hook(name, value, labels)
+            except Exception:
+                log.warning("Metrics hook %r failed on %s", hook, name, exc_info=True)
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, stage=stage)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = {_metric_name(n, l): v for (n, l), v in self.counters.items()}
+            timings = {_metric_name(n, l): {"count": c, "sum": s, "max": m}
+                       for (n, l), (c, s, m) in self.timings.items()}
+        return {"counters": counters, "timings": timings}
+
+    def to_prometheus(self, prefix: str = "classifier_", gauges: dict = None) -> str:
+        """Prometheus text format; `gauges` adds point-in-time values as {(name, labels): value}."""
+        lines = []
+        with self._lock:
+            counters = dict(self.counters)
+            timings = {k: list(v) for k, v in self.timings.items()}
+        for kind, series in (("counter", counters), ("gauge", gauges or {})):
+            for name in sorted({n for n, _ in series}):
+                lines.append(f"# TYPE {prefix}{name} {kind}")
+                for (n, labels), value in sorted(series.items(), key=lambda kv: str(kv[0])):
+                    if n == name:
+                        lines.append(f"{prefix}{_metric_name(n, labels)} {_prom_value(value)}")
+        for name in sorted({n for n, _ in timings}):
+            lines.append(f"# TYPE {prefix}{name} summary")
+            for (n, labels), (count, total, _) in sorted(timings.items(), key=lambda kv: str(kv[0])):
+                if n == name:
+                    lines.append(f"{prefix}{_metric_name(n + '_count', labels)} {count}")
+                    lines.append(f"{prefix}{_metric_name(n + '_sum', labels)} {_prom_value(total)}")
+        return "\n".join(lines) + "\n"
+
+def _prom_value(value) -> str:
+    # full precision: :g keeps 6 significant digits, so a token counter past a million stops moving
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _metric_name(name: str, labels) -> str:
+    labels = tuple(sorted(labels.items())) if isinstance(labels, dict) else labels
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+# === Disk caches ===
+class DiskCache:
+    """SQLite key -> blob store with an entry/byte budget, LRU and TTL eviction, and hit/miss counts.
+
+    Entry and byte totals live in the database (kept current by triggers) and the budget is
+    enforced inside each write transaction, so processes sharing the file share one budget.
+    """
+
+    def __init__(self, path: str, max_entries: int | None = None, max_bytes: int | None = None,
+                 ttl: float | None = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = self.misses = self.evictions = 0
+        self._lock = threading.Lock()
+        # timeout = sqlite busy timeout: concurrent writers wait for the lock instead of failing
+        self._db = sqlite3.connect(path, timeout=CACHE_BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._write():
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0),"
+                " entries INTEGER NOT NULL, bytes INTEGER NOT NULL)"
+            )
+            self._db.execute(
+                "INSERT OR IGNORE INTO totals SELECT 0, COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM entries"
+            )
+            self._db.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN"
+                " UPDATE totals SET entries = entries + 1, bytes = bytes + LENGTH(NEW.value); END"
+            )
+            self._db.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN"
+                " UPDATE totals SET entries = entries - 1, bytes = bytes - LENGTH(OLD.value); END"
+            )
+            self._db.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF value ON entries BEGIN"
+                " UPDATE totals SET bytes = bytes + LENGTH(NEW.value) - LENGTH(OLD.value); END"
+            )
+
+    @contextmanager
+    def _write(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so the totals read inside can't go stale
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def _totals(self) -> tuple[int, int]:
+        return self._db.execute("SELECT entries, bytes FROM totals").fetchone()
+
+    def get_bytes(self, key: str) -> bytes | None:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._delete(key)
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return row[0]
+
+    def put_bytes(self, key: str, blob: bytes) -> None:
+        now = time.time()
+        with self._lock, self._write():
+            # upsert rather than INSERT OR REPLACE: REPLACE's implicit delete doesn't fire triggers
+            self._db.execute(
+                "INSERT INTO entries (key, value, created, accessed) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET value = excluded.value, created = excluded.created,"
+                " accessed = excluded.accessed",
+                (key, blob, now, now),
+            )
+            self._evict()
+
+    def _delete(self, key: str) -> None:
+        self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self.evictions += 1
+
+    def _over_budget(self, count: int, size: int) -> bool:
+        return ((self.max_entries is not None and count > self.max_entries)
+                or (self.max_bytes is not None and size > self.max_bytes))
+
+    def _evict(self) -> None:
+        if not self._over_budget(*self._totals()):
+            return
+        if self.ttl is not None:
+            expired = self._db.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,))
+            self.evictions += expired.rowcount
+        count, size = self._totals()
+        # least recently used first, until back under both budgets
+        for key, n in self._db.execute("SELECT key, LENGTH(value) FROM entries ORDER BY accessed").fetchall():
+            if not self._over_budget(count, size):
+                break
+            self._delete(key)
+            count, size = count - 1, size - n
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        with self._lock:
+            count, size = self._totals()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": count,
+            "bytes": size,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM entries")
+
+class EmbeddingCache(DiskCache):
+    """Query embeddings keyed by sha256(model + normalized text), stored as raw float32 bytes."""
+
+    def __init__(self, path: str = QUERY_CACHE_PATH, max_entries: int | None = QUERY_CACHE_MAX_ENTRIES,
+                 max_bytes: int | None = QUERY_CACHE_MAX_BYTES, ttl: float | None = QUERY_CACHE_TTL):
+        super().__init__(path, max_entries, max_bytes, ttl)
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{_normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def get(self, model: str, text: str) -> np.ndarray | None:
+        blob = self.get_bytes(self.key(model, text))
+        return None if blob is None else np.frombuffer(blob, dtype=np.float32)
+
+    def put(self, model: str, text: str, vec) -> None:
+        self.put_bytes(self.key(model, text), np.asarray(vec, dtype=np.float32).tobytes())
+
+class ResultCache(DiskCache):
+    """Classification results keyed by everything that can change them (see _result_key)."""
+
+    def __init__(self, path: str = RESULT_CACHE_PATH, max_entries: int | None = RESULT_CACHE_MAX_ENTRIES,
+                 max_bytes: int | None = RESULT_CACHE_MAX_BYTES, ttl: float | None = RESULT_CACHE_TTL):
+        super().__init__(path, max_entries, max_bytes, ttl)
+
+    def get(self, key: str) -> dict | None:
+        blob = self.get_bytes(key)
+        return None if blob is None else json.loads(blob)
+
+    def put(self, key: str, result: dict) -> None:
+        self.put_bytes(key, json.dumps(result, ensure_ascii=False).encode("utf-8"))
 
 # === Prompt Template ===
 # FEW_SHOT = """
@@ -239,7 +710,40 @@ Labels: {
 """.strip()
 
 
-def build_prompt(msg: str, cands: list[dict]) -> str:
+COMPACT_FEW_SHOT = """
+Message: "I want to upgrade my data plan and increase my internet speed."
+{"Plan Upgrade": {"reason": "upgrade my data plan", "confidence": 0.98, "retrieved_rank": 1}, "Slow Internet Speed": {"reason": "increase my internet speed", "confidence": 0.89, "retrieved_rank": 2}, "Billing Issue": false}
+Message: "I was charged twice this month and don't know why."
+{"Billing Issue": {"reason": "charged twice this month", "confidence": 0.95, "retrieved_rank": 1}, "Refund Request": {"reason": "likely wants a refund for the double charge", "confidence": 0.83, "retrieved_rank": 2}, "Plan Upgrade": false}
+""".strip()
+
+def build_compact_prompt(msg: str, cands: list[dict]) -> str:
+    # "?" rather than a prefilled false, which nudges the model toward an all-false answer
+    lab_lines = ",\n".join(f'"{c["type"]}": ?' for c in cands)
+    return f"""Multi-label classifier. For each given label (shown as "?") output false, or if the message expresses it \
+{{"reason": short quote or explanation, "confidence": 0-1, "retrieved_rank": 1-{len(cands)}}}. \
+Output only a JSON object with exactly these keys.
+{COMPACT_FEW_SHOT}
+Message: "{msg}"
+{{
+{lab_lines}
+}}"""
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+def count_tokens(text: str, model: str = LLM_MODEL) -> int:
+    if tiktoken is None:
+        return len(text) // 4 + 1
+    return len(_encoding(model).encode(text))
+
+def build_prompt(msg: str, cands: list[dict], compact: bool = False) -> str:
+    if compact:
+        return build_compact_prompt(msg, cands)
     # lab_lines = ",\n  ".join(f'"{c["type"]}": true/false' for c in cands)
     lab_lines = ",\n  ".join(f'"{c["type"]}": true/false or explanation object' for c in cands)
     # return f"""{FEW_SHOT}
@@ -269,7 +773,7 @@ def build_prompt(msg: str, cands: list[dict]) -> str:
     {{
         "reason": "...short explanation or matched text from the message...",
         "confidence": <0 to 1>,
-        "retrieved_rank": <1 to {TOP_K}>
+        "retrieved_rank": <1 to {len(cands)}>
     }}
 
     Only output the JSON object. Do not include any other text or comments.
@@ -279,27 +783,14 @@ def build_prompt(msg: str, cands: list[dict]) -> str:
     """
 
 # === Classify ===
-def classify_message(message: str):
-
-    print("Not in cache, calling OpenAI API...")
-    candidates = retrieve_definitions(message)
-    prompt = build_prompt(message, candidates)
-    print(f"--- prompt ---\n {prompt}")
-    resp = client.chat.completions.create(
-        model=LLM_MODEL,
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.2,
-        max_tokens=256,
-        response_format={"type": "json_object"}
-    )
-
-    raw = resp.choices[0].message.content
-    print(f"--- raw ---\n {raw}")
+def _parse_labels(raw: str, candidates: list[dict], min_confidence: float = MIN_CONFIDENCE,
+                  metrics: Metrics = None) -> dict:
     try:
         labels = json.loads(raw)
     except json.JSONDecodeError:
+        if metrics:
+            metrics.inc("json_fallback_parses_total")
         labels = json.loads(_extract_json(raw))
-
     # Output with confidence + rank
     filtered_out = {}
     output = {}
@@ -327,7 +818,7 @@ def classify_message(message: str):
 
         if isinstance(raw, dict):
             conf = raw.get("confidence", item['normalized'])
-            if conf >= MIN_CONFIDENCE:
+            if conf >= min_confidence:
                 output[label] = {
                     "reason": raw.get("reason", ""),
                     "confidence": round(conf, 3),
@@ -337,15 +828,948 @@ def classify_message(message: str):
                 filtered_out[label] = round(conf, 3)
 
     if filtered_out:
-        print("low-confidence labels:", filtered_out)
+        log.debug("low-confidence labels: %s", filtered_out)
+        if metrics:
+            metrics.inc("low_confidence_labels_total", len(filtered_out))
 
     return output
 
+# === Async helpers ===
+class RateLimiter:
+    """Token-bucket limiter for requests/minute and tokens/minute, shared by all tasks on one loop."""
+
+    def __init__(self, rpm: float | None = None, tpm: float | None = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm or 0)
+        self._tokens = float(tpm or 0)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self._last = now - self._last, now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens: int = 0):
+        tokens = min(tokens, self.tpm) if self.tpm else 0
+        async with self._lock:
+            while True:
+                self._refill()
+                wait_req = max(0.0, 1 - self._requests) * 60 / self.rpm if self.rpm else 0.0
+                wait_tok = max(0.0, tokens - self._tokens) * 60 / self.tpm if self.tpm else 0.0
+                if max(wait_req, wait_tok) <= 0:
+                    break
+                await asyncio.sleep(max(wait_req, wait_tok))
+            if self.rpm:
+                self._requests -= 1
+            if self.tpm:
+                self._tokens -= tokens
+
+def _is_retryable(exc: Exception) -> bool:
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    return isinstance(exc, openai.APIConnectionError)
+
+async def _with_retries(call, max_retries: int = None):
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    for attempt in range(max_retries + 1):
+        try:
+            return await call()
+        except Exception as exc:
+            if attempt == max_retries or not _is_retryable(exc):
+                raise
+            # exponential backoff with jitter so parallel tasks don't retry in lockstep
+            delay = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt)
+            await asyncio.sleep(delay * (0.5 + random.random() / 2))
+
+# === Local head ===
+class LocalHead:
+    """One-vs-rest logistic regression over unit-normalized query embeddings (NumPy only).
+
+    decide() answers for a message only when every retrieved candidate is a trained label
+    with probability >= high or <= low and at least one is positive; otherwise it returns
+    None and the message goes to the LLM.
+    """
+
+    def __init__(self, labels: list[str], weights: np.ndarray = None, bias: np.ndarray = None,
+                 trained: np.ndarray = None, low: float = LOCAL_HEAD_LOW, high: float = LOCAL_HEAD_HIGH):
+        self.labels = list(labels)
+        self.index = {label: i for i, label in enumerate(self.labels)}
+        self.weights = weights
+        self.bias = bias
+        self.trained = np.zeros(len(self.labels), dtype=bool) if trained is None else trained
+        self.low = low
+        self.high = high
+
+    def fit(self, X: np.ndarray, Y: np.ndarray, epochs: int = 500, lr: float = 0.05, l2: float = 1e-4,
+            min_positives: int = LOCAL_HEAD_MIN_POSITIVES):
+        """Full-batch Adam on the mean binary cross-entropy; X is (n, dim), Y is (n, n_labels) 0/1."""
+        X = np.asarray(X, dtype=np.float32)
+        Y = np.asarray(Y, dtype=np.float32)
+        W = np.zeros((X.shape[1], Y.shape[1]), dtype=np.float32)
+        b = np.zeros(Y.shape[1], dtype=np.float32)
+        m = [np.zeros_like(W), np.zeros_like(b)]
+        v = [np.zeros_like(W), np.zeros_like(b)]
+        for t in range(1, epochs + 1):
+            err = (_sigmoid(X @ W + b) - Y) / len(X)
+            grads = [X.T @ err + l2 * W, err.sum(axis=0)]
+            for i, (param, grad) in enumerate(zip((W, b), grads)):
+                m[i] = 0.9 * m[i] + 0.1 * grad
+                v[i] = 0.999 * v[i] + 0.001 * grad * grad
+                param -= lr * (m[i] / (1 - 0.9 ** t)) / (np.sqrt(v[i] / (1 - 0.999 ** t)) + 1e-8)
+        self.weights, self.bias = W, b
+        self.trained = Y.sum(axis=0) >= min_positives
+        return self
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        return _sigmoid(np.asarray(X, dtype=np.float32) @ self.weights + self.bias)
+
+    def decide(self, probs: np.ndarray, candidates: list[dict]) -> dict | None:
+        idx = [self.index.get(c["type"]) for c in candidates]
+        if any(i is None or not self.trained[i] for i in idx):
+            return None
+        p = probs[idx]
+        if ((p > self.low) & (p < self.high)).any() or not (p >= self.high).any():
+            return None
+        return {
+            c["type"]: {"reason": "local model", "confidence": round(float(pc), 3), "retrieved_rank": rank}
+            for rank, (c, pc) in enumerate(zip(candidates, p), start=1)
+            if pc >= self.high
+        }
+
+    def save(self, path: str = LOCAL_HEAD_PATH):
+        np.savez(path, labels=np.array(self.labels), weights=self.weights, bias=self.bias,
+                 trained=self.trained, thresholds=np.array([self.low, self.high]))
+
+    @classmethod
+    def load(cls, path: str = LOCAL_HEAD_PATH):
+        with np.load(path) as data:
+            low, high = data["thresholds"]
+            return cls(data["labels"].tolist(), data["weights"], data["bias"], data["trained"],
+                       float(low), float(high))
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-np.clip(z, -30, 30)))
+
+class _Lazy:
+    """Per-process, lazily created Classifier resource. Assigning a value injects it (e.g. a fake client)."""
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        return obj._resource(self.name, self.factory)
+
+    def __set__(self, obj, value):
+        obj._resources[self.name] = value
+        obj._owned.discard(self.name)
+
+class Classifier:
+    """Client, taxonomy, definition matrix and config for one classification setup.
+
+    Nothing touches the network or disk until first use (or warm_up()). The definition
+    matrix is read-only, so calling warm_up() before forking lets workers share it;
+    clients and SQLite caches are re-created in each child process on first use.
+    """
+
+    client = _Lazy(lambda self: OpenAI(api_key=os.getenv("OPENAI_API_KEY")))
+    # retries are handled by _with_retries, not the SDK
+    aclient = _Lazy(lambda self: AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0))
+    embedding_cache = _Lazy(lambda self: EmbeddingCache())
+    result_cache = _Lazy(lambda self: ResultCache())
+
+    def __init__(self, taxonomy: list[dict] = None, embed_model: str = EMBED_MODEL, llm_model: str = LLM_MODEL,
+                 top_k: int = TOP_K, min_confidence: float = MIN_CONFIDENCE, store_dir: str = EMBED_STORE_DIR,
+                 store_dtype: str = EMBED_STORE_DTYPE, compact_prompt: bool = COMPACT_PROMPT,
+                 adaptive_k: bool = ADAPTIVE_K, local_head: LocalHead = None, index: str = RETRIEVAL_INDEX,
+                 nprobe: int = INDEX_NPROBE, quantize: bool = INDEX_QUANTIZE,
+                 shadow_rate: float = LOCAL_HEAD_SHADOW_RATE, **resources):
+        self.taxonomy = inquiry_types if taxonomy is None else taxonomy
+        self.embed_model = embed_model
+        self.llm_model = llm_model
+        self.top_k = top_k
+        self.min_confidence = min_confidence
+        self.store_dir = store_dir
+        self.store_dtype = store_dtype
+        self.compact_prompt = compact_prompt
+        self.adaptive_k = adaptive_k
+        self.local_head = local_head
+        self.shadow_rate = shadow_rate
+        self.index_kind = index
+        self.nprobe = nprobe
+        self.quantize = quantize
+        self._index = None
+        self.metrics = Metrics()
+        agreement = ("compared", "exact_agree", "label_tp", "label_fp", "label_fn")
+        self.routing = dict.fromkeys(("local", "llm", *agreement, *(f"shadow_{key}" for key in agreement)), 0)
+        self.load_seconds = None
+        self._matrix = None
+        self._pid = os.getpid()
+        self._resources = {}
+        self._owned = set()
+        for name, value in resources.items():  # client=, aclient=, embedding_cache=, result_cache=
+            if not isinstance(getattr(type(self), name, None), _Lazy):
+                raise TypeError(f"unexpected resource {name!r}")
+            setattr(self, name, value)
+
+    def _resource(self, name: str, factory):
+        if os.getpid() != self._pid:
+            # forked: HTTP pools and SQLite connections must not be shared with the parent
+            self._pid = os.getpid()
+            for owned in self._owned:
+                self._resources.pop(owned, None)
+            self._owned.clear()
+        if name not in self._resources:
+            self._resources[name] = factory(self)
+            self._owned.add(name)
+        return self._resources[name]
+
+    def warm_up(self):
+        """Load the definition matrix (embedding any new definitions), build the index and open the caches now."""
+        self.retrieval_index
+        self.embedding_cache
+        self.result_cache
+        return self
+
+    @property
+    def _index_owns_vectors(self) -> bool:
+        # an int8 index holds the only copy; keeping the float32 matrix as well would undo the saving
+        return self.quantize and self.index_kind != "exact"
+
+    def _load_matrix(self) -> np.ndarray:
+        start = time.perf_counter()
+        vectors = self.load_definition_embeddings()
+        matrix = vectors if vectors.dtype == np.float32 else np.array(vectors, dtype=np.float32)
+        matrix.flags.writeable = False
+        self.load_seconds = time.perf_counter() - start
+        return matrix
+
+    @property
+    def definition_matrix(self) -> np.ndarray:
+        # pre-normalized float32, one row per taxonomy entry; rebuilt from the codes on every
+        # access when the index owns the vectors
+        if self._index_owns_vectors:
+            return self.retrieval_index.reconstruct()
+        if self._matrix is None:
+            self._matrix = self._load_matrix()
+        return self._matrix
+
+    @property
+    def retrieval_index(self):
+        if self._index is None:
+            kwargs = {} if self.index_kind == "exact" else {"nprobe": self.nprobe, "quantize": self.quantize}
+            matrix = self._load_matrix() if self._index_owns_vectors else self.definition_matrix
+            self._index = build_index(self.index_kind, matrix, self.taxonomy, **kwargs)
+        return self._index
+
+    def index_recall(self, queries=None, k: int = None, n_queries: int = 200, noise: float = 0.05) -> dict:
+        """Recall@k and per-query latency of the configured index against exact search.
+
+        Without `queries`, uses definition vectors perturbed by gaussian noise as stand-in queries.
+        """
+        k = k or self.top_k
+        # exact baseline on the stored vectors, not on an int8 index's dequantized copy
+        matrix = self._load_matrix() if self._index_owns_vectors else self.definition_matrix
+        if queries is None:
+            rng = np.random.default_rng(0)
+            rows = rng.choice(len(matrix), min(n_queries, len(matrix)), replace=False)
+            queries = matrix[rows] + rng.standard_normal((len(rows), matrix.shape[1]), dtype=np.float32) * noise
+        queries = _unit_rows(queries)
+        exact = ExactIndex(matrix)
+        timings = {}
+        for name, index in (("exact", exact), (self.index_kind, self.retrieval_index)):
+            start = time.perf_counter()
+            for q in queries:
+                index.search(q[None, :], k)
+            timings[f"{name}_ms_per_query"] = (time.perf_counter() - start) * 1e3 / len(queries)
+        return {"index": self.index_kind, "k": k, f"recall@{k}": measure_recall(self.retrieval_index, exact, queries, k),
+                **timings}
+
+    def footprint(self) -> dict:
+        """Cold-start and memory numbers for the definition matrix (the index's codes when it owns the vectors)."""
+        if self._index_owns_vectors:
+            index = self.retrieval_index
+            return {
+                "labels": index.size,
+                "dim": int(index.centroids.shape[1]),
+                "matrix_bytes": index.nbytes,
+                "memory_mapped": False,
+                "load_seconds": self.load_seconds,
+            }
+        matrix = self.definition_matrix
+        return {
+            "labels": int(matrix.shape[0]),
+            "dim": int(matrix.shape[1]),
+            "matrix_bytes": int(matrix.nbytes),
+            "memory_mapped": isinstance(matrix, np.memmap),
+            "load_seconds": self.load_seconds,
+        }
+
+    # --- Embeddings ---
+    def _lookup_cached(self, texts: list[str]):
+        # de-duplicate by cache key; returns (key -> text, key -> cached vector, keys still missing)
+        by_key = {}
+        for text in texts:
+            by_key.setdefault(EmbeddingCache.key(self.embed_model, text), text)
+
+        vectors = {}
+        missing = []
+        for key, text in by_key.items():
+            cached = self.embedding_cache.get(self.embed_model, text)
+            if cached is not None:
+                vectors[key] = cached.tolist()
+            else:
+                missing.append(key)
+        return by_key, vectors, missing
+
+    def _store_batch(self, batch: list[str], resp, vectors: dict):
+        for text, item in zip(batch, sorted(resp.data, key=lambda d: d.index)):
+            self.embedding_cache.put(self.embed_model, text, item.embedding)
+            vectors[EmbeddingCache.key(self.embed_model, text)] = item.embedding
+
+    def _record_usage(self, resp, api: str):
+        usage = getattr(resp, "usage", None)
+        if usage is None:
+            return
+        for kind in ("prompt_tokens", "completion_tokens"):
+            value = getattr(usage, kind, None)
+            if value:
+                self.metrics.inc("tokens_total", value, api=api, kind=kind.split("_")[0])
+
+    def get_embeddings(self, texts: list[str]) -> list[list[float]]:
+        """Embed many texts: cache lookups first, then misses de-duplicated and packed into few requests."""
+        with self.metrics.timer("embed"):
+            by_key, vectors, missing = self._lookup_cached(texts)
+            for batch in _pack_batches([by_key[key] for key in missing]):
+                resp = self.client.embeddings.create(model=self.embed_model, input=batch)
+                self._record_usage(resp, "embeddings")
+                self._store_batch(batch, resp, vectors)
+        return [vectors[EmbeddingCache.key(self.embed_model, text)] for text in texts]
+
+    async def aget_embeddings(self, texts: list[str]) -> list[list[float]]:
+        """Async counterpart of get_embeddings (same cache, same batching)."""
+        with self.metrics.timer("embed"):
+            by_key, vectors, missing = self._lookup_cached(texts)
+            for batch in _pack_batches([by_key[key] for key in missing]):
+                resp = await _with_retries(lambda: self.aclient.embeddings.create(model=self.embed_model, input=batch))
+                self._record_usage(resp, "embeddings")
+                self._store_batch(batch, resp, vectors)
+        return [vectors[EmbeddingCache.key(self.embed_model, text)] for text in texts]
+
+    # --- Save/load definition embeddings ---
+    # Binary store: <store_dir>/vectors.npy (one unit-length row per definition, memory-mappable)
+    # plus manifest.json mapping each row to sha256(model + type + definition).
+    def _definition_key(self, item: dict) -> str:
+        raw = f"{self.embed_model}\0{item['type']}\0{item['definition']}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _store_paths(self) -> tuple[str, str]:
+        return os.path.join(self.store_dir, "manifest.json"), os.path.join(self.store_dir, "vectors.npy")
+
+    def _read_store(self):
+        manifest_path, vectors_path = self._store_paths()
+        if not (os.path.exists(manifest_path) and os.path.exists(vectors_path)):
+            return {}, None
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        return manifest, np.load(vectors_path, mmap_mode="r")
+
+    def _read_legacy_json(self):
+        # seed from the old definition_embeddings.json so existing checkouts don't re-embed everything;
+        # an entry is reused only if it records the exact definition text it was embedded from
+        if self.embed_model != EMBED_CACHE_MODEL or not os.path.exists(EMBED_CACHE_PATH):
+            return [], None
+        with open(EMBED_CACHE_PATH) as f:
+            by_type = {item["type"]: item for item in json.load(f)}
+        found = [item for item in self.taxonomy
+                 if by_type.get(item["type"], {}).get("definition") == item["definition"]]
+        if not found:
+            return [], None
+        return [self._definition_key(item) for item in found], np.asarray([by_type[item["type"]]["embedding"] for item in found])
+
+    def save_definition_embeddings(self, keys: list[str], vectors: np.ndarray):
+        manifest_path, vectors_path = self._store_paths()
+        os.makedirs(self.store_dir, exist_ok=True)
+        # write to temp files and swap in, so a crash never leaves a half-written store behind
+        with open(vectors_path + ".tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(vectors, dtype=self.store_dtype))
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump({
+                "model": self.embed_model,
+                "dtype": self.store_dtype,
+                "dim": int(vectors.shape[1]),
+                "normalized": True,
+                "types": [item["type"] for item in self.taxonomy],
+                "keys": keys,
+            }, f, indent=1)
+        os.replace(vectors_path + ".tmp", vectors_path)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def load_definition_embeddings(self) -> np.ndarray:
+        keys = [self._definition_key(item) for item in self.taxonomy]
+        manifest, stored = self._read_store()
+        stored_keys = manifest.get("keys", [])
+        if stored is None:
+            stored_keys, stored = self._read_legacy_json()
+        elif stored_keys == keys and manifest.get("normalized") and stored.dtype == self.store_dtype:
+            return stored
+
+        row_of = {key: row for row, key in enumerate(stored_keys)}
+        missing = [i for i, key in enumerate(keys) if key not in row_of]
+        if missing:
+            log.info("Embedding %d new or changed definitions...", len(missing))
+        fresh = dict(zip(missing, self.get_embeddings([self.taxonomy[i]["definition"] for i in missing])))
+
+        vectors = _unit_rows(
+            [fresh[i] if i in fresh else stored[row_of[key]] for i, key in enumerate(keys)]
+        ).astype(self.store_dtype)
+        self.save_definition_embeddings(keys, vectors)
+        return vectors
+
+    # --- Retrieval ---
+    def score_queries(self, q_vecs) -> np.ndarray:
+        """Cosine scores of every query vector against every label: (n_queries, n_labels)."""
+        return self.retrieval_index.score(_unit_rows(q_vecs))
+
+    def _candidates(self, top, top_scores, min_scores, max_scores) -> list[list[dict]]:
+        results = []
+        for row, idx in enumerate(top):
+            span = max_scores[row] - min_scores[row] + 1e-8
+            results.append([
+                {
+                    "type": self.taxonomy[i]["type"],
+                    "definition": self.taxonomy[i]["definition"],
+                    "score": float(score),
+                    "normalized": float((score - min_scores[row]) / span),
+                }
+                for i, score in zip(idx, top_scores[row])
+            ])
+        if self.adaptive_k:
+            results = [_adaptive_cut(cands) for cands in results]
+        return results
+
+    def _retrieve_vectors(self, vectors, k: int = None) -> list[list[dict]]:
+        with self.metrics.timer("retrieve"):
+            k = min(k or self.top_k, len(self.taxonomy))
+            return self._candidates(*self.retrieval_index.search(_unit_rows(vectors), k))
+
+    def retrieve_batch(self, messages: list[str], k: int = None) -> list[list[dict]]:
+        """Top-k candidates per message from the retrieval index (one matrix product for exact search)."""
+        if not messages:
+            return []
+        return self._retrieve_vectors(self.get_embeddings(messages), k)
+
+    def retrieve_transcript(self, transcript: str, k: int = None, pooling: str = None,
+                            top_segments: int = None) -> tuple[list[dict], list[str]]:
+        """Pooled candidates for a long transcript, plus its most relevant segments in original order."""
+        segments = split_transcript(transcript)
+        if not segments:
+            return [], []
+        queries = _unit_rows(self.get_embeddings(segments))
+        k = min(k or self.top_k, len(self.taxonomy))
+        with self.metrics.timer("retrieve"):
+            index = self.retrieval_index
+            # pool over every label for exact search; a two-stage index pools over the union of
+            # each segment's own top-k, so only the probed clusters are ever scored
+            ids = (np.arange(len(self.taxonomy)) if isinstance(index, ExactIndex)
+                   else np.unique(index.search(queries, k)[0]))
+            scores = index.score(queries, ids)
+            pooled = pool_segment_scores(scores, pooling)[None, :]
+            best = _top_k_indices(pooled, min(k, len(ids)))
+            candidates = self._candidates(ids[best], np.take_along_axis(pooled, best, axis=1),
+                                          pooled.min(axis=1), pooled.max(axis=1))[0]
+
+        # best holds column positions in scores, in candidate order (adaptive_k may drop the tail)
+        relevance = scores[:, best[0][:len(candidates)]].max(axis=1)
+        keep = sorted(_top_k_indices(relevance[None, :], top_segments or SEGMENT_TOP_N)[0])
+        return candidates, [segments[i] for i in keep]
+
+    # --- Local head routing ---
+    def train_local_head(self, messages: list[str], label_sets: list, **fit_kwargs) -> LocalHead:
+        """Fit a LocalHead from labelled messages; label_sets items are label lists or classify() outputs."""
+        Y = np.zeros((len(messages), len(self.taxonomy)), dtype=np.float32)
+        index = {item["type"]: i for i, item in enumerate(self.taxonomy)}
+        for row, labels in enumerate(label_sets):
+            for label in labels:
+                Y[row, index[label]] = 1
+        X = _unit_rows(self.get_embeddings(messages))
+        self.local_head = LocalHead([item["type"] for item in self.taxonomy]).fit(X, Y, **fit_kwargs)
+        return self.local_head
+
+    def _local_outputs(self, vectors, candidate_sets: list[list[dict]]):
+        # -> (per-message local result or None, per-message probabilities or None)
+        if self.local_head is None:
+            return [None] * len(candidate_sets), [None] * len(candidate_sets)
+        probs = self.local_head.predict_proba(_unit_rows(vectors))
+        outputs = [self.local_head.decide(p, cands) for p, cands in zip(probs, candidate_sets)]
+        for out in outputs:
+            path = "local" if out is not None else "llm"
+            self.routing[path] += 1
+            self.metrics.inc("routed_total", path=path)
+        return outputs, list(probs)
+
+    def _tally_agreement(self, local: set, llm: set, prefix: str = ""):
+        r = self.routing
+        r[prefix + "compared"] += 1
+        r[prefix + "exact_agree"] += local == llm
+        r[prefix + "label_tp"] += len(local & llm)
+        r[prefix + "label_fp"] += len(local - llm)
+        r[prefix + "label_fn"] += len(llm - local)
+
+    def _record_agreement(self, probs: np.ndarray, candidates: list[dict], llm_output: dict):
+        # messages the head sent to the LLM: what it would have said at p >= 0.5, compared only
+        # on the candidates it has a column for (decide() routes the others to the LLM on purpose)
+        if probs is None:
+            return
+        known = {c["type"]: self.local_head.index[c["type"]] for c in candidates if c["type"] in self.local_head.index}
+        if not known:
+            return
+        local = {label for label, i in known.items() if probs[i] >= 0.5}
+        self._tally_agreement(local, set(llm_output) & known.keys())
+
+    def _shadow_sample(self) -> bool:
+        return bool(self.shadow_rate) and random.random() < self.shadow_rate
+
+    def _record_shadow(self, local_output: dict, llm_output: dict):
+        # messages the head answered itself: what it actually returned
+        self.metrics.inc("shadow_samples_total")
+        self._tally_agreement(set(local_output), set(llm_output), prefix="shadow_")
+
+    def routing_stats(self) -> dict:
+        """Share of messages answered locally, and how the local head agrees with the LLM.
+
+        Plain agreement covers messages routed to the LLM; shadow_* covers the shadow_rate sample
+        of locally answered messages that were also sent to the LLM.
+        """
+        r = self.routing
+        routed = r["local"] + r["llm"]
+        stats = {**r, "local_rate": r["local"] / routed if routed else 0.0}
+        for prefix in ("", "shadow_"):
+            tp, fp, fn = r[prefix + "label_tp"], r[prefix + "label_fp"], r[prefix + "label_fn"]
+            compared = r[prefix + "compared"]
+            stats.update({
+                prefix + "exact_agreement": r[prefix + "exact_agree"] / compared if compared else 0.0,
+                prefix + "label_precision": tp / (tp + fp) if tp + fp else 0.0,
+                prefix + "label_recall": tp / (tp + fn) if tp + fn else 0.0,
+            })
+        return stats
+
+    def retrieve(self, message: str, k: int = None) -> list[dict]:
+        top = self.retrieve_batch([message], k)[0]
+        _log_candidates(top)
+        return top
+
+    # --- Instrumentation ---
+    def export_prometheus(self) -> str:
+        """Metrics plus cache and matrix gauges in Prometheus text format (caches are not opened for this)."""
+        gauges = {}
+        for name in ("embedding_cache", "result_cache"):
+            cache = self._resources.get(name)
+            if cache is None:
+                continue
+            cache_label = (("cache", name.split("_")[0]),)
+            for stat, value in cache.stats().items():
+                gauges[(f"cache_{stat}", cache_label)] = value
+        if self._matrix is not None:
+            gauges[("definition_matrix_bytes", ())] = self._matrix.nbytes
+        elif self._index is not None and self._index_owns_vectors:
+            gauges[("definition_matrix_bytes", ())] = self._index.nbytes
+        return self.metrics.to_prometheus(gauges=gauges)
+
+    # --- Classify ---
+    def _completion_request(self, prompt: str, n_labels: int) -> dict:
+        return dict(
+            model=self.llm_model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.2,
+            max_tokens=OUTPUT_TOKENS_BASE + OUTPUT_TOKENS_PER_LABEL * n_labels,
+            response_format={"type": "json_object"}
+        )
+
+    def _prompt_version(self) -> str:
+        # hash of the rendered template with placeholders, so any edit to build_prompt/FEW_SHOT changes it
+        template = build_prompt("{message}", [{"type": "{label}", "definition": "{definition}"}],
+                                self.compact_prompt)
+        return hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
+
+    def _result_key(self, message: str, candidates: list[dict]) -> str:
+        request = self._completion_request("", len(candidates))
+        request.pop("messages")
+        key = {
+            "message": _normalize_text(message).casefold(),
+            "candidates": [c["type"] for c in candidates],
+            "request": request,  # llm_model, temperature, max_tokens, ...
+            "prompt": self._prompt_version(),
+            "min_confidence": self.min_confidence,
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _cached_result(self, message: str, candidates: list[dict]):
+        key = self._result_key(message, candidates)
+        cached = self.result_cache.get(key)
+        self.metrics.inc("result_cache_lookups_total", result="hit" if cached is not None else "miss")
+        return key, cached
+
+    def _build_request(self, message: str, candidates: list[dict]):
+        with self.metrics.timer("prompt_build"):
+            prompt = build_prompt(message, candidates, self.compact_prompt)
+            request = self._completion_request(prompt, len(candidates))
+            prompt_tokens = count_tokens(prompt, self.llm_model)
+        # local estimate, before the call; tokens_total has what the API billed
+        self.metrics.inc("tokens_estimated_total", prompt_tokens, api="chat", kind="prompt")
+        log.debug("--- prompt (%d tokens) ---\n %s", prompt_tokens, prompt)
+        return request, prompt_tokens
+
+    def _finish(self, key: str, resp, candidates: list[dict]) -> dict:
+        self._record_usage(resp, "chat")
+        raw = resp.choices[0].message.content
+        log.debug("--- raw ---\n %s", raw)
+        with self.metrics.timer("parse"):
+            output = _parse_labels(raw, candidates, self.min_confidence, self.metrics)
+        self.result_cache.put(key, output)
+        return output
+
+    def _label_candidates(self, message: str, candidates: list[dict]):
+        key, cached = self._cached_result(message, candidates)
+        if cached is not None:
+            return cached
+
+        log.debug("Not in cache, calling OpenAI API...")
+        request, _ = self._build_request(message, candidates)
+        with self.metrics.timer("llm_call"):
+            resp = self.client.chat.completions.create(**request)
+        return self._finish(key, resp, candidates)
+
+    def _classify_routed(self, messages: list[str], vectors, candidate_sets: list[list[dict]]) -> list[dict]:
+        local_outputs, probs = self._local_outputs(vectors, candidate_sets)
+        results = []
+        for message, cands, local, p in zip(messages, candidate_sets, local_outputs, probs):
+            if local is None:
+                local = self._label_candidates(message, cands)
+                self._record_agreement(p, cands, local)
+            elif self._shadow_sample():
+                try:
+                    self._record_shadow(local, self._label_candidates(message, cands))
+                except Exception:
+                    log.warning("Shadow LLM call failed", exc_info=True)
+            results.append(local)
+        return results
+
+    def classify(self, message: str) -> dict:
+        # embed once: the same vector feeds retrieval and the local head
+        vectors = self.get_embeddings([message])
+        candidates = self._retrieve_vectors(vectors)[0]
+        _log_candidates(candidates)
+        return self._classify_routed([message], vectors, [candidates])[0]
+
+    def classify_transcript(self, transcript: str, pooling: str = None, top_segments: int = None) -> dict:
+        """Classify a long transcript from pooled per-segment retrieval, sending only the key segments."""
+        candidates, segments = self.retrieve_transcript(transcript, pooling=pooling, top_segments=top_segments)
+        if not candidates:
+            return {}
+        return self._label_candidates("\n...\n".join(segments), candidates)
+
+    def classify_batch(self, messages: list[str]) -> list[dict]:
+        """Classify many messages; embeddings for the whole list are fetched in batched requests."""
+        if not messages:
+            return []
+        vectors = self.get_embeddings(messages)
+        candidate_sets = self._retrieve_vectors(vectors)
+        return self._classify_routed(messages, vectors, candidate_sets)
+
+    async def _aembed_each(self, messages: list[str], semaphore: asyncio.Semaphore) -> list:
+        async def embed_one(message: str):
+            async with semaphore:
+                return (await self.aget_embeddings([message]))[0]
+        return await asyncio.gather(*(embed_one(m) for m in messages), return_exceptions=True)
+
+    async def classify_batch_async(self, messages: list[str], concurrency: int = None, rpm: float = None,
+                                   tpm: float = None, timeout: float = None, return_exceptions: bool = False,
+                                   limiter: RateLimiter = None, semaphore: asyncio.Semaphore = None) -> list:
+        """Classify messages concurrently; results come back in input order.
+
+        At most `concurrency` LLM calls are in flight, calls are paced by an rpm/tpm limiter,
+        429/5xx responses are retried with exponential backoff and each call attempt gets `timeout`
+        seconds from when it leaves the queue. With return_exceptions=True a failed message
+        (including one whose embedding is rejected) yields its exception instead of aborting the
+        whole batch. Pass a shared `limiter` and `semaphore` to pace several batches as one.
+        """
+        if not messages:
+            return []
+        timeout = MESSAGE_TIMEOUT if timeout is None else timeout
+        limiter = limiter or RateLimiter(rpm or LLM_RPM, tpm or LLM_TPM)
+        semaphore = semaphore or asyncio.Semaphore(concurrency or ASYNC_CONCURRENCY)
+        aclient = self.aclient
+
+        try:
+            vectors = await self.aget_embeddings(messages)
+        except Exception as exc:
+            if len(messages) == 1 or _is_retryable(exc):
+                # nothing to isolate: a single message, or the API itself is failing
+                if not return_exceptions:
+                    raise
+                vectors = [exc] * len(messages)
+            else:
+                # a non-retryable error (e.g. 400 for one over-long input) fails the whole request:
+                # embed each message alone so only the bad ones fail
+                vectors = await self._aembed_each(messages, semaphore)
+
+        ok = [i for i, v in enumerate(vectors) if not isinstance(v, BaseException)]
+        candidate_sets, local_outputs, probs = list(vectors), [None] * len(messages), [None] * len(messages)
+        if ok:
+            good = [vectors[i] for i in ok]
+            good_sets = self._retrieve_vectors(good)
+            good_local, good_probs = self._local_outputs(good, good_sets)
+            for j, i in enumerate(ok):
+                candidate_sets[i], local_outputs[i], probs[i] = good_sets[j], good_local[j], good_probs[j]
+
+        async def classify_one(message: str, candidates, local: dict | None, p):
+            if isinstance(candidates, BaseException):
+                raise candidates
+            if local is not None:
+                if self._shadow_sample():
+                    try:
+                        self._record_shadow(local, await label_with_llm(message, candidates))
+                    except Exception:
+                        log.warning("Shadow LLM call failed", exc_info=True)
+                return local
+            output = await label_with_llm(message, candidates)
+            self._record_agreement(p, candidates, output)
+            return output
+
+        inflight = {}  # result key -> task, so duplicate messages in the batch share one LLM call
+
+        async def label_with_llm(message: str, candidates: list[dict]):
+            key, cached = self._cached_result(message, candidates)
+            if cached is not None:
+                return cached
+            if key not in inflight:
+                inflight[key] = asyncio.ensure_future(request_labels(key, message, candidates))
+            return await inflight[key]
+
+        async def request_labels(key: str, message: str, candidates: list[dict]):
+            request, prompt_tokens = self._build_request(message, candidates)
+
+            async def call():
+                async with semaphore:
+                    await limiter.acquire(prompt_tokens + request["max_tokens"])
+                    # the clock starts here, so time spent queueing never counts against the timeout
+                    with self.metrics.timer("llm_call"):
+                        return await asyncio.wait_for(aclient.chat.completions.create(**request), timeout)
+
+            resp = await _with_retries(call)
+            return self._finish(key, resp, candidates)
+
+        return await asyncio.gather(
+            *(classify_one(*args) for args in zip(messages, candidate_sets, local_outputs, probs)),
+            return_exceptions=return_exceptions,
+        )
+
+# === Default classifier (module-level API) ===
+_default_classifier = None
+
+def get_classifier() -> Classifier:
+    """Shared Classifier built from the module config; created on first use, not at import."""
+    global _default_classifier
+    if _default_classifier is None:
+        _default_classifier = Classifier()
+    return _default_classifier
+
+def get_embeddings(texts: list[str]) -> list[list[float]]:
+    return get_classifier().get_embeddings(texts)
+
+def get_embedding(text: str) -> list[float]:
+    return get_embeddings([text])[0]
+
+def load_definition_embeddings() -> np.ndarray:
+    return get_classifier().load_definition_embeddings()
+
+def score_queries(q_vecs) -> np.ndarray:
+    return get_classifier().score_queries(q_vecs)
+
+def retrieve_definitions_batch(messages: list[str], k: int = TOP_K) -> list[list[dict]]:
+    return get_classifier().retrieve_batch(messages, k)
+
+def retrieve_definitions(message: str, k: int = TOP_K):
+    return get_classifier().retrieve(message, k)
+
+def classify_message(message: str):
+    return get_classifier().classify(message)
+
+def classify_transcript(transcript: str, **kwargs) -> dict:
+    return get_classifier().classify_transcript(transcript, **kwargs)
+
+def classify_messages(messages: list[str]) -> list[dict]:
+    return get_classifier().classify_batch(messages)
+
+async def classify_messages_async(messages: list[str], **kwargs) -> list:
+    return await get_classifier().classify_batch_async(messages, **kwargs)
+
 def pretty(obj):
     print(json.dumps(obj, indent=2, ensure_ascii=False))
 
+# === Batch CLI ===
+def read_messages(path: str, text_field: str = "message", id_field: str = "id"):
+    """Yield (row_number, id, text) from a JSONL or CSV file, or stdin when path is "-".
+
+    Stdin lines may be JSON objects or plain text. A row that cannot be parsed or has no
+    text field yields a ValueError in place of the text, so it is reported and checkpointed
+    like any other row instead of stopping the run.
+    """
+    f = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+    try:
+        if path.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (_parse_line(line, text_field) for line in f if line.strip())
+        for n, row in enumerate(rows):
+            if isinstance(row, Exception):
+                yield n, n, row
+                continue
+            text = row.get(text_field)
+            if not isinstance(text, str):
+                text = ValueError(f"missing or non-string {text_field!r} field")
+            yield n, row.get(id_field, n), text
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def _parse_line(line: str, text_field: str):
+    if not line.lstrip().startswith("{"):
+        return {text_field: line.rstrip("\n")}
+    try:
+        row = json.loads(line)
+    except json.JSONDecodeError as exc:
+        return ValueError(f"invalid JSON: {exc}")
+    return row if isinstance(row, dict) else ValueError("JSON row is not an object")
+
+def _count_rows(path: str) -> int | None:
+    # cheap line count for the ETA (approximate for CSVs with multi-line fields)
+    if path == "-":
+        return None
+    with open(path, "rb") as f:
+        lines = sum(1 for line in f if line.strip())
+    return lines - 1 if path.lower().endswith(".csv") else lines
+
+def _read_checkpoint(path: str) -> dict:
+    if not os.path.exists(path):
+        return {"rows_done": 0, "output_bytes": 0}
+    with open(path) as f:
+        return json.load(f)
+
+def _write_checkpoint(path: str, state: dict):
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+async def run_batch(input_path: str, output_path: str, text_field: str = "message", id_field: str = "id",
+                    chunk_size: int = None, concurrency: int = None, resume: bool = True):
+    """Stream messages from input_path, classify them chunk by chunk and append results as JSONL.
+
+    Up to BATCH_CHUNKS_AHEAD later chunks are classified while one waits on its slowest row,
+    all sharing one rate limiter and concurrency limit. After each chunk the output is fsynced
+    and <output>.ckpt records how many input rows are done and the output size at that point. A restarted run truncates any partial chunk
+    and skips finished rows, so every row is written exactly once.
+    """
+    chunk_size = chunk_size or BATCH_CHUNK_SIZE
+    ckpt_path = output_path + ".ckpt"
+    state = {"rows_done": 0, "output_bytes": 0}
+    if resume and os.path.exists(output_path):
+        state = _read_checkpoint(ckpt_path)
+        size = os.path.getsize(output_path)
+        if state["output_bytes"] > size:
+            # truncate() would pad with NULs and every row up to rows_done would be skipped
+            raise ValueError(f"{ckpt_path} expects {state['output_bytes']} bytes of output but {output_path} "
+                             f"has {size}; rerun with --no-resume to start over")
+    elif os.path.exists(ckpt_path):
+        os.remove(ckpt_path)  # a stale checkpoint must not outlive the output it described
+    total = _count_rows(input_path)
+
+    out = open(output_path, "r+b" if state["output_bytes"] else "wb")
+    out.truncate(state["output_bytes"])
+    out.seek(state["output_bytes"])
+    if state["rows_done"]:
+        print(f"Resuming after {state['rows_done']} rows", file=sys.stderr)
+
+    rows = islice(read_messages(input_path, text_field, id_field), state["rows_done"], None)
+    # one limiter and one semaphore for the whole run, so rpm/tpm and concurrency hold across chunks
+    limiter = RateLimiter(LLM_RPM, LLM_TPM)
+    semaphore = asyncio.Semaphore(concurrency or ASYNC_CONCURRENCY)
+
+    async def classify_chunk(chunk):
+        valid = [text for _, _, text in chunk if isinstance(text, str)]
+        classified = iter(await classify_messages_async(valid, limiter=limiter, semaphore=semaphore,
+                                                        return_exceptions=True))
+        return [next(classified) if isinstance(text, str) else text for _, _, text in chunk]
+
+    start, done_here = time.time(), 0
+    pending = deque()  # (chunk, task) in input order; results are written and checkpointed in that order
+    try:
+        while True:
+            while len(pending) <= BATCH_CHUNKS_AHEAD and (chunk := list(islice(rows, chunk_size))):
+                pending.append((chunk, asyncio.ensure_future(classify_chunk(chunk))))
+            if not pending:
+                break
+            chunk, task = pending.popleft()
+            results = await task
+            for (n, row_id, _), result in zip(chunk, results):
+                record = {"id": row_id, "row": n}
+                if isinstance(result, BaseException):
+                    record["error"] = f"{type(result).__name__}: {result}"
+                else:
+                    record["labels"] = result
+                out.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+            out.flush()
+            os.fsync(out.fileno())
+
+            state = {"rows_done": chunk[-1][0] + 1, "output_bytes": out.tell()}
+            _write_checkpoint(ckpt_path, state)
+
+            done_here += len(chunk)
+            rate = done_here / max(time.time() - start, 1e-9)
+            eta = f", ETA {(total - state['rows_done']) / rate:.0f}s" if total else ""
+            print(f"{state['rows_done']} rows done ({rate:.1f} rows/s{eta})", file=sys.stderr)
+    finally:
+        for _, task in pending:
+            task.cancel()
+        await asyncio.gather(*(task for _, task in pending), return_exceptions=True)
+        out.close()
+    return state
+
 # === Run ===
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-label inquiry classification.")
+    parser.add_argument("input", nargs="?", help='JSONL/CSV file of messages, or "-" for stdin')
+    parser.add_argument("-o", "--output", help="JSONL results file (required with input)")
+    parser.add_argument("--text-field", default="message")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE)
+    parser.add_argument("--concurrency", type=int, default=ASYNC_CONCURRENCY)
+    parser.add_argument("--no-resume", action="store_true", help="ignore any checkpoint and start over")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log retrieval, prompts and raw LLM output")
+    args = parser.parse_args(argv)
+    if args.input and not args.output:
+        parser.error("--output is required when classifying an input file")
+    return args
+
 if __name__ == "__main__":
+    args = _parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(message)s")
+    if args.input:
+        asyncio.run(run_batch(args.input, args.output, args.text_field, args.id_field,
+                              args.chunk_size, args.concurrency, resume=not args.no_resume))
+        sys.exit(0)
+
     test_input = """
     Hi, I want to cancel my current family plan. Also, I’d like to port out two of the numbers to a prepaid plan, 
     and get a refund for the unused days if possible.
@@ -356,4 +1780,6 @@ if __name__ == "__main__":
     start = time.time()
     result = classify_message(test_input)
     pretty(result)
-    print(f"Took {time.time() - start:.2f} seconds")
\ No newline at end of file
+    print(f"Took {time.time() - start:.2f} seconds")
+    if args.verbose:
+        print(get_classifier().export_prometheus())
\ No newline at end of file
@@ -0,0 +1,47 @@
+"""Shared fixtures: a Classifier wired to fake_openai with its store and caches under tmp_path."""
+import numpy as np
+import pytest
+
+import main
+from fake_openai import DIM, FakeAsyncOpenAI, FakeOpenAI
+
+TAXONOMY = main.inquiry_types[:20]
+
+MESSAGES = [
+    "I was charged twice this month and want a refund.",
+    "I need more time to pay my overdue bill.",
+    "Please set up automatic payments with my card.",
+    "Can you move my billing cycle due date?",
+    "I want to upgrade to a faster plan.",
+    "Add a new line to my family plan please.",
+]
+
+
+@pytest.fixture
+def make_classifier(tmp_path):
+    def make(taxonomy=TAXONOMY, **kwargs):
+        return main.Classifier(
+            taxonomy=taxonomy,
+            embed_model=kwargs.pop("embed_model", "fake-embedding"),
+            store_dir=str(tmp_path / "store"),
+            client=kwargs.pop("client", FakeOpenAI()),
+            aclient=kwargs.pop("aclient", FakeAsyncOpenAI()),
+            embedding_cache=main.EmbeddingCache(str(tmp_path / "embeddings.sqlite")),
+            result_cache=main.ResultCache(str(tmp_path / "results.sqlite")),
+            **kwargs,
+        )
+    return make
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(main, "LLM_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(main, "LLM_BACKOFF_MAX", 0.01)
+
+
+def confident_head(taxonomy, positive: str, untrained: tuple = ()) -> main.LocalHead:
+    # p ~ 1 for `positive`, ~ 0 for every other label, whatever the message; `untrained` labels are left out
+    labels = [item["type"] for item in taxonomy if item["type"] not in untrained]
+    bias = np.array([10.0 if label == positive else -10.0 for label in labels], dtype=np.float32)
+    weights = np.zeros((DIM, len(labels)), dtype=np.float32)
+    return main.LocalHead(labels, weights, bias, np.ones(len(labels), dtype=bool))
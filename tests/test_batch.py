@@ -0,0 +1,103 @@
+"""Batch CLI: streaming input, per-row errors, checkpoint truncate/resume."""
+import asyncio, json
+
+import pytest
+
+import main
+from conftest import MESSAGES
+
+
+@pytest.fixture
+def default_classifier(make_classifier, monkeypatch):
+    clf = make_classifier()
+    monkeypatch.setattr(main, "_default_classifier", clf)
+    return clf
+
+
+def _write_jsonl(path, rows):
+    path.write_text("".join((row if isinstance(row, str) else json.dumps(row)) + "\n" for row in rows))
+
+
+def _read_jsonl(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def _messages(n):
+    return [{"id": f"m{i}", "message": MESSAGES[i % len(MESSAGES)]} for i in range(n)]
+
+
+def test_checkpoint_truncates_partial_chunk_and_resumes(default_classifier, tmp_path):
+    src, out = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    _write_jsonl(src, _messages(10))
+    asyncio.run(main.run_batch(str(src), str(out), chunk_size=4))
+
+    # crash after the first chunk: checkpoint covers 4 rows, output has a torn line after them
+    first_chunk = out.read_bytes().split(b"\n", 4)
+    ckpt = {"rows_done": 4, "output_bytes": len(b"\n".join(first_chunk[:4])) + 1}
+    (tmp_path / "out.jsonl.ckpt").write_text(json.dumps(ckpt))
+    with open(out, "r+b") as f:
+        f.truncate(ckpt["output_bytes"])
+        f.seek(0, 2)
+        f.write(b'{"id": "m4", "ro')
+
+    state = asyncio.run(main.run_batch(str(src), str(out), chunk_size=4))
+    records = _read_jsonl(out)
+    assert state["rows_done"] == 10
+    assert [r["row"] for r in records] == list(range(10))
+    assert all("labels" in r for r in records)
+
+
+def test_malformed_rows_become_error_records(default_classifier, tmp_path):
+    src, out = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    _write_jsonl(src, [{"id": "a", "message": MESSAGES[0]}, {"id": "b"}, "{not json",
+                       {"id": "d", "message": MESSAGES[1]}])
+    asyncio.run(main.run_batch(str(src), str(out), chunk_size=2))
+    records = _read_jsonl(out)
+    assert [r["row"] for r in records] == [0, 1, 2, 3]
+    assert "labels" in records[0] and "labels" in records[3]
+    assert records[1]["error"].startswith("ValueError") and records[2]["error"].startswith("ValueError")
+    assert json.loads((tmp_path / "out.jsonl.ckpt").read_text())["rows_done"] == 4
+
+
+def test_no_resume_discards_the_old_checkpoint(default_classifier, tmp_path, monkeypatch):
+    src, out = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    _write_jsonl(src, _messages(8))
+    asyncio.run(main.run_batch(str(src), str(out), chunk_size=4))
+
+    async def crash(*args, **kwargs):
+        raise RuntimeError("killed")
+
+    with monkeypatch.context() as m:
+        m.setattr(main, "classify_messages_async", crash)
+        with pytest.raises(RuntimeError):
+            asyncio.run(main.run_batch(str(src), str(out), chunk_size=4, resume=False))
+    assert not (tmp_path / "out.jsonl.ckpt").exists()
+
+    asyncio.run(main.run_batch(str(src), str(out), chunk_size=4))
+    assert [r["row"] for r in _read_jsonl(out)] == list(range(8))
+
+
+def test_checkpoint_beyond_the_output_is_refused(default_classifier, tmp_path):
+    src, out = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    _write_jsonl(src, _messages(2))
+    out.write_bytes(b"")
+    (tmp_path / "out.jsonl.ckpt").write_text(json.dumps({"rows_done": 2, "output_bytes": 272}))
+    with pytest.raises(ValueError):
+        asyncio.run(main.run_batch(str(src), str(out)))
+    assert out.read_bytes() == b""
+
+
+def test_rate_limit_and_concurrency_are_shared_across_chunks(default_classifier, tmp_path, monkeypatch):
+    src, out = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    _write_jsonl(src, [{"id": i, "message": f"{MESSAGES[0]} ({i})"} for i in range(9)])
+    seen = []
+    classify = main.classify_messages_async
+
+    async def spy(messages, **kwargs):
+        seen.append((kwargs["limiter"], kwargs["semaphore"]))
+        return await classify(messages, **kwargs)
+
+    monkeypatch.setattr(main, "classify_messages_async", spy)
+    asyncio.run(main.run_batch(str(src), str(out), chunk_size=3))
+    assert len(seen) == 3 and len(set(seen)) == 1
+    assert [r["row"] for r in _read_jsonl(out)] == list(range(9))
@@ -0,0 +1,12 @@
+"""SQLite disk caches: budget shared across connections."""
+import main
+
+
+def test_cache_budget_is_shared_between_connections(tmp_path):
+    a = main.DiskCache(str(tmp_path / "c.sqlite"), max_entries=5)
+    b = main.DiskCache(str(tmp_path / "c.sqlite"), max_entries=5)
+    for i in range(10):
+        (a if i % 2 else b).put_bytes(str(i), b"x" * 10)
+    assert a._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 5
+    assert a.stats()["entries"] == b.stats()["entries"] == 5
+    assert a.stats()["bytes"] == 50
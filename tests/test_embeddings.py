@@ -0,0 +1,33 @@
+"""Batched embeddings: request packing, de-duplication and the embedding cache."""
+import main
+from conftest import MESSAGES
+from fake_openai import FakeOpenAI, fake_embedding
+
+
+def test_pack_batches_respects_item_and_char_limits():
+    texts = ["a" * 30, "b" * 30, "c" * 30, "d" * 80, "e" * 5]
+    assert main._pack_batches(texts, max_items=2, max_chars=1000) == [texts[0:2], texts[2:4], texts[4:]]
+    assert main._pack_batches(texts, max_items=10, max_chars=70) == [texts[0:2], texts[2:3], texts[3:4], texts[4:]]
+    # an over-long text still gets a request of its own rather than being dropped
+    assert main._pack_batches(["x" * 500], max_items=10, max_chars=70) == [["x" * 500]]
+    assert main._pack_batches([]) == []
+
+
+def test_pack_batches_reads_limits_at_call_time(monkeypatch):
+    monkeypatch.setattr(main, "EMBED_BATCH_MAX_ITEMS", 4)
+    assert [len(b) for b in main._pack_batches(["t"] * 10)] == [4, 4, 2]
+
+
+def test_duplicates_are_embedded_once_and_cached(make_classifier, monkeypatch):
+    monkeypatch.setattr(main, "EMBED_BATCH_MAX_ITEMS", 2)
+    client = FakeOpenAI()
+    clf = make_classifier(client=client)
+    texts = MESSAGES[:3] + MESSAGES[:3]
+    vectors = clf.get_embeddings(texts)
+    assert client.calls["embeddings"] == 2  # 3 unique texts, 2 per request
+    assert vectors[:3] == vectors[3:] == [fake_embedding(t) for t in MESSAGES[:3]]
+
+    assert clf.get_embeddings(MESSAGES[2::-1]) == vectors[2::-1]
+    assert client.calls["embeddings"] == 2  # served from the cache
+    clf.get_embeddings(MESSAGES[:4])
+    assert client.calls["embeddings"] == 3  # only the new text was requested
@@ -0,0 +1,37 @@
+"""Local head routing: single embedding, shadow sampling, agreement stats."""
+import main
+from conftest import TAXONOMY, confident_head
+
+
+def test_classify_embeds_message_once(make_classifier, monkeypatch):
+    clf = make_classifier(local_head=confident_head(TAXONOMY, "Billing Issue"), shadow_rate=0)
+    clf.warm_up()
+    embedded = []
+    get_embeddings = clf.get_embeddings
+    monkeypatch.setattr(clf, "get_embeddings", lambda texts: embedded.append(texts) or get_embeddings(texts))
+    clf.classify("billing question")
+    assert embedded == [["billing question"]]
+
+
+def test_shadow_sample_reports_agreement_on_local_answers(make_classifier):
+    clf = make_classifier(local_head=confident_head(TAXONOMY, "Billing Issue"), shadow_rate=1.0)
+    assert clf.classify("billing question") == clf.classify_batch(["billing question"])[0]
+    stats = clf.routing_stats()
+    assert stats["local"] == 2 and stats["llm"] == 0
+    assert stats["shadow_compared"] == 2 and stats["shadow_exact_agreement"] == 1.0
+
+
+def test_agreement_skips_labels_the_head_does_not_know(make_classifier):
+    # every message retrieves the untrained label, so decide() always defers to the LLM
+    clf = make_classifier(taxonomy=TAXONOMY[:3], local_head=confident_head(TAXONOMY[:3], "Billing Issue",
+                                                                         untrained=(TAXONOMY[2]["type"],)))
+    assert isinstance(clf.classify("billing question"), dict)
+    stats = clf.routing_stats()
+    assert stats["llm"] == 1 and stats["compared"] == 1
+
+
+def test_local_head_round_trips_through_save(tmp_path):
+    head = confident_head(TAXONOMY, "Billing Issue")
+    head.save(str(tmp_path / "head.npz"))
+    loaded = main.LocalHead.load(str(tmp_path / "head.npz"))
+    assert loaded.labels == head.labels and (loaded.bias == head.bias).all()
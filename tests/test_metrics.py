@@ -0,0 +1,33 @@
+"""Metrics: hooks and the Prometheus text export."""
+import main
+from conftest import MESSAGES
+
+
+def test_prometheus_export_keeps_full_precision():
+    metrics = main.Metrics()
+    metrics.inc("tokens_total", 1_234_567, kind="prompt")
+    metrics.inc("tokens_total", 1, kind="prompt")
+    metrics.observe("stage_seconds", 0.1234567, stage="llm")
+    metrics.observe("stage_seconds", 2.0, stage="llm")
+    text = metrics.to_prometheus(gauges={("matrix_bytes", ()): 3_000_000.0})
+    assert "# TYPE classifier_tokens_total counter" in text
+    assert 'classifier_tokens_total{kind="prompt"} 1234568\n' in text
+    assert 'classifier_stage_seconds_count{stage="llm"} 2\n' in text
+    assert f'classifier_stage_seconds_sum{{stage="llm"}} {0.1234567 + 2.0!r}\n' in text
+    assert "# TYPE classifier_matrix_bytes gauge\nclassifier_matrix_bytes 3000000\n" in text
+
+
+def test_hooks_see_every_update_and_failures_are_contained(make_classifier, caplog):
+    seen = []
+
+    def broken(name, value, labels):
+        raise RuntimeError("exporter down")
+
+    clf = make_classifier()
+    clf.metrics.add_hook(broken)
+    clf.metrics.add_hook(lambda name, value, labels: seen.append((name, labels)))
+    with caplog.at_level("WARNING", logger="classifier"):
+        assert isinstance(clf.classify(MESSAGES[0]), dict)
+    assert ("stage_seconds", {"stage": "llm_call"}) in seen
+    assert any(name == "tokens_total" for name, _ in seen)
+    assert "Metrics hook" in caplog.text
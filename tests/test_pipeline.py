@@ -0,0 +1,100 @@
+"""Async pipeline on FakeAsyncOpenAI: ordering, retries, timeouts, rate limiting, failure isolation."""
+import asyncio, time
+
+import numpy as np
+import pytest
+
+import main
+from conftest import MESSAGES
+from fake_openai import FakeAPIError, FakeAsyncOpenAI
+
+
+def test_results_keep_input_order(make_classifier):
+    expected = make_classifier(aclient=FakeAsyncOpenAI()).classify_batch(MESSAGES)
+    clf = make_classifier(aclient=FakeAsyncOpenAI(latency=0.02, jitter=0.02, seed=3))
+    clf.result_cache.clear()
+    assert asyncio.run(clf.classify_batch_async(MESSAGES, concurrency=4)) == expected
+
+
+def test_retryable_errors_are_retried(make_classifier, fast_backoff):
+    aclient = FakeAsyncOpenAI(error_rate=0.3, seed=1)
+    clf = make_classifier(aclient=aclient)
+    results = asyncio.run(clf.classify_batch_async(MESSAGES, return_exceptions=True))
+    assert aclient.calls["errors"] > 0
+    assert not any(isinstance(r, BaseException) for r in results)
+
+
+def test_client_errors_are_not_retried(fast_backoff):
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        raise FakeAPIError(400)
+
+    with pytest.raises(FakeAPIError):
+        asyncio.run(main._with_retries(call, max_retries=5))
+    assert len(attempts) == 1
+
+
+def test_backoff_grows_between_retries(monkeypatch):
+    monkeypatch.setattr(main, "LLM_BACKOFF_BASE", 0.02)
+    stamps = []
+
+    async def call():
+        stamps.append(time.monotonic())
+        if len(stamps) < 4:
+            raise FakeAPIError(429)
+        return "ok"
+
+    assert asyncio.run(main._with_retries(call)) == "ok"
+    gaps = np.diff(stamps)
+    # jittered 0.5-1x of 0.02, 0.04, 0.08
+    assert gaps[0] >= 0.01 and gaps[2] >= 0.04 and gaps[2] > gaps[0]
+
+
+def test_message_timeout_yields_timeout_error(make_classifier):
+    clf = make_classifier(aclient=FakeAsyncOpenAI(latency=0.3))
+    results = asyncio.run(clf.classify_batch_async(MESSAGES[:2], timeout=0.05, return_exceptions=True))
+    assert all(isinstance(r, asyncio.TimeoutError) for r in results)
+
+
+def test_rate_limiter_paces_requests_and_tokens():
+    async def run(limiter, n, tokens=0):
+        start = time.monotonic()
+        for _ in range(n):
+            await limiter.acquire(tokens)
+        return time.monotonic() - start
+
+    rpm = main.RateLimiter(rpm=600)  # 10/s once the initial burst of 600 is spent
+    assert asyncio.run(run(rpm, 600)) < 0.1
+    assert asyncio.run(run(rpm, 3)) >= 0.25
+
+    tpm = main.RateLimiter(tpm=60_000)  # 1000 tokens/s
+    assert asyncio.run(run(tpm, 1, 60_000)) < 0.1
+    assert asyncio.run(run(tpm, 1, 200)) >= 0.15
+
+
+def test_rejected_embedding_fails_only_that_message(make_classifier):
+    aclient = FakeAsyncOpenAI(max_input_chars=200)
+    clf = make_classifier(aclient=aclient)
+    clf.warm_up()
+    results = asyncio.run(clf.classify_batch_async([MESSAGES[0], "x" * 500, MESSAGES[1]], return_exceptions=True))
+    assert isinstance(results[1], FakeAPIError) and results[1].status_code == 400
+    assert isinstance(results[0], dict) and isinstance(results[2], dict)
+
+
+def test_queue_wait_does_not_count_against_timeout(make_classifier):
+    # 20 calls of 0.05s through 2 slots queue for ~0.5s, well past the 0.2s per-call timeout
+    clf = make_classifier(aclient=FakeAsyncOpenAI(latency=0.05))
+    messages = [f"{MESSAGES[i % len(MESSAGES)]} (ticket {i})" for i in range(20)]
+    results = asyncio.run(clf.classify_batch_async(messages, concurrency=2, timeout=0.2, return_exceptions=True))
+    assert not any(isinstance(r, BaseException) for r in results)
+
+
+def test_rejected_single_message_is_returned_not_raised(make_classifier):
+    clf = make_classifier(aclient=FakeAsyncOpenAI(max_input_chars=200))
+    clf.warm_up()
+    results = asyncio.run(clf.classify_batch_async(["x" * 500], return_exceptions=True))
+    assert isinstance(results[0], FakeAPIError)
+    with pytest.raises(FakeAPIError):
+        asyncio.run(clf.classify_batch_async(["y" * 500]))
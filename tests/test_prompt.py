@@ -0,0 +1,30 @@
+"""Compact prompt and adaptive candidate count."""
+import main
+
+
+def _cands(scores, normalized=None):
+    normalized = normalized or [1.0] * len(scores)
+    return [{"type": f"label {i}", "score": s, "normalized": n} for i, (s, n) in enumerate(zip(scores, normalized))]
+
+
+def test_compact_prompt_does_not_prefill_answers():
+    prompt = main.build_compact_prompt("hi", [{"type": "Billing Issue"}, {"type": "Refund Request"}])
+    answer_block = prompt[prompt.rfind("{"):]
+    assert "false" not in answer_block and '"Billing Issue": ?' in answer_block
+
+
+def test_adaptive_cut_stops_at_the_first_score_gap():
+    cands = _cands([0.80, 0.78, 0.77, 0.60, 0.59])
+    assert len(main._adaptive_cut(cands, min_k=1, gap=0.05, min_normalized=0.0)) == 3
+
+
+def test_adaptive_cut_stops_below_the_normalized_threshold():
+    cands = _cands([0.80, 0.79, 0.78, 0.77], normalized=[1.0, 0.9, 0.4, 0.3])
+    assert len(main._adaptive_cut(cands, min_k=1, gap=1.0, min_normalized=0.5)) == 2
+
+
+def test_adaptive_cut_keeps_min_k_and_handles_short_lists():
+    cands = _cands([0.9, 0.1, 0.0])  # gap inside the first min_k is ignored
+    assert len(main._adaptive_cut(cands, min_k=2, gap=0.05, min_normalized=0.0)) == 2
+    assert main._adaptive_cut(cands[:1], min_k=3, gap=0.05, min_normalized=0.0) == cands[:1]
+    assert main._adaptive_cut([], min_k=3) == []
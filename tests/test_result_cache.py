@@ -0,0 +1,21 @@
+"""Classification result cache and in-flight de-duplication."""
+import asyncio
+
+from conftest import MESSAGES
+from fake_openai import FakeAsyncOpenAI, FakeOpenAI
+
+
+def test_duplicate_messages_share_one_llm_call(make_classifier):
+    aclient = FakeAsyncOpenAI(latency=0.01)
+    clf = make_classifier(aclient=aclient)
+    results = asyncio.run(clf.classify_batch_async(MESSAGES[:2] * 3))
+    assert aclient.calls["chat"] == 2
+    assert results[0] == results[2] == results[4]
+
+
+def test_repeated_message_is_answered_from_the_cache(make_classifier):
+    client = FakeOpenAI()
+    clf = make_classifier(client=client)
+    first = clf.classify(MESSAGES[0])
+    assert clf.classify(MESSAGES[0]) == first
+    assert client.calls["chat"] == 1
@@ -0,0 +1,35 @@
+"""Retrieval indexes: int8 storage, and scoring that never dequantizes the whole matrix."""
+import numpy as np
+
+import main
+from conftest import MESSAGES, TAXONOMY
+from fake_openai import DIM
+
+
+def test_int8_index_owns_the_only_copy(make_classifier):
+    clf = make_classifier(index="ivf", quantize=True).warm_up()
+    assert clf._matrix is None
+    assert clf.footprint()["matrix_bytes"] < len(TAXONOMY) * DIM * 4 / 2
+
+
+def test_int8_scores_match_the_dequantized_matrix(make_classifier):
+    clf = make_classifier(index="ivf", quantize=True).warm_up()
+    index = clf.retrieval_index
+    queries = main._unit_rows(clf.get_embeddings(MESSAGES))
+    ids = np.array([3, 0, 7])
+    expected = queries @ index.reconstruct().T
+    assert np.allclose(index.score(queries), expected, atol=1e-5)
+    assert np.allclose(index.score(queries, ids), expected[:, ids], atol=1e-5)
+
+
+def test_transcript_scoring_does_not_dequantize(make_classifier, monkeypatch):
+    clf = make_classifier(index="ivf", quantize=True).warm_up()
+    transcript = "\n\n".join(MESSAGES * 4)
+
+    def refuse(self):
+        raise AssertionError("full matrix rebuilt from the codes")
+
+    monkeypatch.setattr(main.IVFIndex, "reconstruct", refuse)
+    candidates, segments = clf.retrieve_transcript(transcript)
+    assert candidates and segments
+    assert clf.score_queries(clf.get_embeddings(MESSAGES[:1])).shape == (1, len(TAXONOMY))
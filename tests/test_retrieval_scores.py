@@ -0,0 +1,47 @@
+"""Vectorized retrieval against the original one-pair-at-a-time cosine ranking."""
+import math
+
+import numpy as np
+
+import main
+from conftest import MESSAGES, TAXONOMY
+from fake_openai import fake_embedding
+
+
+def _cosine(a, b):
+    # the pre-numpy implementation, kept as the reference
+    dot = sum(x * y for x, y in zip(a, b))
+    return dot / (math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b)) + 1e-8)
+
+
+def _reference_top(q_vec, k):
+    scored = [{"type": item["type"], "score": _cosine(q_vec, fake_embedding(item["definition"]))}
+              for item in TAXONOMY]
+    max_score, min_score = max(s["score"] for s in scored), min(s["score"] for s in scored)
+    for s in scored:
+        s["normalized"] = (s["score"] - min_score) / (max_score - min_score + 1e-8)
+    return sorted(scored, key=lambda s: s["score"], reverse=True)[:k]
+
+
+def test_score_matrix_matches_pairwise_cosine(make_classifier):
+    clf = make_classifier(store_dtype="float32")
+    vectors = clf.get_embeddings(MESSAGES)
+    expected = [[_cosine(v, fake_embedding(item["definition"])) for item in TAXONOMY] for v in vectors]
+    np.testing.assert_allclose(clf.score_queries(vectors), expected, atol=1e-5)
+
+
+def test_top_k_matches_reference_ranking(make_classifier):
+    clf = make_classifier(store_dtype="float32", adaptive_k=False)
+    for message, cands in zip(MESSAGES, clf.retrieve_batch(MESSAGES, k=5)):
+        expected = _reference_top(fake_embedding(message), 5)
+        assert [c["type"] for c in cands] == [e["type"] for e in expected]
+        np.testing.assert_allclose([c["score"] for c in cands], [e["score"] for e in expected], atol=1e-5)
+        np.testing.assert_allclose([c["normalized"] for c in cands], [e["normalized"] for e in expected], atol=1e-4)
+
+
+def test_top_k_indices_are_sorted_best_first():
+    scores = np.random.default_rng(0).standard_normal((4, 50)).astype(np.float32)
+    top = main._top_k_indices(scores, 7)
+    np.testing.assert_array_equal(top, np.argsort(-scores, axis=1)[:, :7])
+    assert main._top_k_indices(scores, 0).shape == (4, 0)
+    assert main._top_k_indices(scores, 99).shape == (4, 50)
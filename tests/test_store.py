@@ -0,0 +1,23 @@
+"""Definition vector store: migration from the legacy JSON cache."""
+import json
+
+import numpy as np
+
+import main
+from conftest import TAXONOMY
+from fake_openai import fake_embedding
+
+
+def test_legacy_vectors_are_not_reused_for_edited_definitions(make_classifier, tmp_path, monkeypatch):
+    taxonomy = [dict(item) for item in TAXONOMY[:2]]
+    legacy = [{"type": item["type"], "definition": item["definition"], "embedding": fake_embedding("stale")}
+              for item in taxonomy]
+    path = tmp_path / "legacy.json"
+    path.write_text(json.dumps(legacy))
+    monkeypatch.setattr(main, "EMBED_CACHE_PATH", str(path))
+    taxonomy[1]["definition"] = "Customer disputes a charge on a bill."
+
+    clf = make_classifier(taxonomy=taxonomy, embed_model=main.EMBED_CACHE_MODEL, store_dtype="float32")
+    matrix = clf.definition_matrix
+    np.testing.assert_allclose(matrix[0], fake_embedding("stale"), atol=1e-6)
+    np.testing.assert_allclose(matrix[1], fake_embedding(taxonomy[1]["definition"]), atol=1e-6)
@@ -0,0 +1,34 @@
+"""Long transcripts: segmentation and pooling of per-segment label scores."""
+import numpy as np
+import pytest
+
+import main
+
+
+def test_split_transcript_packs_consecutive_turns():
+    text = "Agent: hello\n\nCustomer: my bill is wrong\nAgent: let me check\n   \nCustomer: thanks"
+    assert main.split_transcript(text, max_chars=36) == [
+        "Agent: hello", "Customer: my bill is wrong", "Agent: let me check\nCustomer: thanks",
+    ]
+    assert main.split_transcript(text, max_chars=1000) == [
+        "Agent: hello\nCustomer: my bill is wrong\nAgent: let me check\nCustomer: thanks",
+    ]
+    assert main.split_transcript("\n \n") == []
+
+
+def test_split_transcript_cuts_over_long_turns():
+    segments = main.split_transcript("x" * 25 + "\nok", max_chars=10)
+    assert segments == ["x" * 10, "x" * 10, "xxxxx\nok"]
+    assert all(len(s) <= 10 for s in segments)
+
+
+def test_pool_segment_scores():
+    scores = np.array([[0.9, 0.1, 0.5], [0.2, 0.3, 0.5]], dtype=np.float32)
+    np.testing.assert_allclose(main.pool_segment_scores(scores, "max"), [0.9, 0.3, 0.5])
+    # attention sits between mean and max, and approaches max as the temperature drops
+    soft = main.pool_segment_scores(scores, "attention", temperature=1.0)
+    sharp = main.pool_segment_scores(scores, "attention", temperature=0.01)
+    assert np.all(soft >= scores.mean(axis=0) - 1e-6) and np.all(soft <= scores.max(axis=0) + 1e-6)
+    np.testing.assert_allclose(sharp, [0.9, 0.3, 0.5], atol=1e-4)
+    with pytest.raises(ValueError):
+        main.pool_segment_scores(scores, "mean")